@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 2026
+
+Build cache for the plots, maps and dashboard pages.
+Each output is stamped with a fingerprint of what it was made from (the data, the
+settings and the code), and is only made again when the fingerprint changes.
+The stamps are kept one per output in a .buildcache folder next to the outputs,
+so outputs made at the same time (i.e. by the plot processes) do not clash.
+"""
+
+import os
+import hashlib
+import inspect
+import numpy as np
+import pandas as pd
+
+cachedir=".buildcache" #folder of the stamps, next to the outputs
+codehashes={} #source file hashes read by codeversion
+
+
+def codeversion(*code):
+    """
+    Fingerprint of the source files of modules / functions (or file names),
+    so the outputs are made again when the code making them changes
+    """
+    h=hashlib.sha1()
+    for c in code:
+        filename=c if isinstance(c,str) else inspect.getsourcefile(c)
+        if filename not in codehashes:
+            with open(filename,"rb") as f:
+                codehashes[filename]=hashlib.sha1(f.read()).hexdigest()
+        h.update(codehashes[filename].encode())
+    return h.hexdigest()
+
+
+def addhash(h,item):
+    """
+    Add an input to the hash h, data frames are hashed by value (index, columns and values),
+    dictionaries, lists and tuples by their items and everything else by its repr
+    """
+    if isinstance(item,(pd.DataFrame,pd.Series)):
+        h.update(pd.util.hash_pandas_object(item,index=True).values.tobytes())
+        if isinstance(item,pd.DataFrame):
+            h.update(repr(list(item.columns)).encode())
+    elif isinstance(item,np.ndarray):
+        h.update(np.ascontiguousarray(item).tobytes())
+    elif isinstance(item,dict):
+        h.update(b"{")
+        for k in sorted(item,key=repr):
+            h.update(repr(k).encode())
+            addhash(h,item[k])
+        h.update(b"}")
+    elif isinstance(item,(list,tuple)):
+        h.update(b"[")
+        for i in item:
+            addhash(h,i)
+        h.update(b"]")
+    else:
+        h.update(repr(item).encode())
+        h.update(b";")
+
+
+def fingerprint(*inputs):
+    """
+    Fingerprint (sha1 hex) of all the inputs of an output
+    """
+    h=hashlib.sha1()
+    for item in inputs:
+        addhash(h,item)
+    return h.hexdigest()
+
+
+def stampfile(target):
+    """
+    Name of the stamp file of an output
+    """
+    folder,name=os.path.split(target)
+    return os.path.join(folder,cachedir,name+".key")
+
+
+def isfresh(target,key,outputs=None):
+    """
+    True if target was made from the inputs with fingerprint key and all its outputs
+    (target if not given) are still there, so it does not need making again
+    """
+    outputs=outputs or [target]
+    if not all(os.path.exists(o) for o in outputs):
+        return False
+    try:
+        with open(stampfile(target)) as f:
+            return f.read().strip()==key
+    except (IOError,OSError):
+        return False
+
+
+def stamp(target,key):
+    """
+    Record that target was made from the inputs with fingerprint key
+    """
+    filename=stampfile(target)
+    folder=os.path.dirname(filename)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    with open(filename,"w") as f:
+        f.write(key)
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 2026
+
+Colour scales of the maps, tiles and colour bars (see colorscales and getscale).
+Only needs numpy, so the tiles (AQTiles) can use the scales without loading folium.
+"""
+
+import logging
+import numpy as np
+
+logger=logging.getLogger(__name__)
+
+#set varables for all fuctions 
+#colors used for the color bar and the data plots 
+colors=["tan","palegreen","greenyellow","green","yellow","orange","red","darkred","purple"]
+##colors=["grey","greenyellow","yellow","salmon","darkorange","red","darkorchid","purple"]
+
+colorbar_values=np.array([0,1,2,3,4,5,6,7,8,10])
+colorbar_max_value=12.00
+
+scaling = 1.0
+
+colorbar_values=colorbar_values/scaling
+colorbar_max_value=colorbar_max_value/scaling
+
+#if len(colorbar_values) != 11:  
+#   print("Error in colorbar_values length = ",len(colorbar_values))
+#   sys.exit()
+#
+if colorbar_max_value < colorbar_values[-1]:
+   logger.error('Error in colorbar_max_value %s %s', colorbar_max_value, colorbar_values[-1])
+
+#named colour scales, chosen per call with scale="name" (or a dict like these)
+#colors[i] is used for values from values[i] up to values[i+1], so values has one more entry than colors
+#under / over are used for values outside the scale and nan for missing data
+colorscales={
+    "default":{"colors":colors,"values":colorbar_values,"max":colorbar_max_value,
+               "under":"black","over":"black","nan":"black"},
+    #UK Daily Air Quality Index, PM2.5 bands 1-10 (ug/m^3)
+    "DAQI":{"colors":["#9CFF9C","#31FF00","#31CF00","#FFFF00","#FFCF00","#FF9A00","#FF6464","#FF0000","#990000","#CE30FF"],
+            "values":np.array([0,12,24,36,42,48,54,59,65,71,100]),"max":100,
+            "under":"black","over":"#CE30FF","nan":"grey"},
+    #WHO 2021 24 hour PM2.5 guideline and interim targets (ug/m^3)
+    "WHO":{"colors":["green","yellowgreen","yellow","orange","red","purple"],
+           "values":np.array([0,15,25,37.5,50,75,150]),"max":150,
+           "under":"black","over":"purple","nan":"grey"},
+}
+
+
+def getscale(scale):
+    """
+    Get a colour scale from colorscales by name, or use the dict given
+    """
+    if isinstance(scale,str):
+        return colorscales[scale]
+    return scale
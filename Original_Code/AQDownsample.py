@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 2026
+
+Time series downsampling for the plots.
+Multi-day series have far more readings than a plot has pixels, and mpld3 writes
+every point into the html, so the series are cut down to a fixed number of points
+before plotting, keeping the peaks (spikes) of the data.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def minmaxbuckets(x,y,target=2000):
+    """
+    Min / max envelope downsampling, x is split into target/2 equal width buckets
+    (pixel columns) and the lowest and highest reading in each bucket are kept,
+    so every spike is still drawn.
+    The first missing (NaN) reading in a bucket is kept too so gaps in the data stay gaps.
+    Returns the sorted index of the points kept
+    """
+    x=np.asarray(x,dtype=float)
+    y=np.asarray(y,dtype=float)
+    n=len(y)
+    nbuckets=max(1,target//2)
+    if n<=target:
+        return np.arange(n)
+    span=x[-1]-x[0]
+    if span>0:
+        buckets=np.minimum(((x-x[0])/span*nbuckets).astype(np.int64),nbuckets-1)
+    else:
+        buckets=np.arange(n)*nbuckets//n
+    nan=np.isnan(y)
+    valid=np.flatnonzero(~nan)
+    gaps=np.flatnonzero(nan)
+    gaps=gaps[np.concatenate(([True],buckets[gaps][1:]!=buckets[gaps][:-1]))] if len(gaps) else gaps
+    if len(valid)==0: #all missing, only the gaps are left
+        return gaps
+    #sort the readings by bucket then value, the ends of each bucket run are its min and max
+    order=valid[np.lexsort((y[valid],buckets[valid]))]
+    b=buckets[order]
+    starts=np.flatnonzero(np.concatenate(([True],b[1:]!=b[:-1])))
+    stops=np.append(starts[1:],len(b))-1
+    return np.unique(np.concatenate((order[starts],order[stops],gaps)))
+
+
+def lttb(x,y,target=2000):
+    """
+    Largest triangle three buckets downsampling, picks the point in each bucket making
+    the largest triangle with the point picked before and the mean of the next bucket.
+    Keeps the shape of the line with one point per bucket, spikes are kept when they are
+    the largest in their bucket. Missing (NaN) readings are left out.
+    Returns the sorted index of the points kept
+    """
+    x=np.asarray(x,dtype=float)
+    y=np.asarray(y,dtype=float)
+    valid=np.flatnonzero(~np.isnan(y))
+    n=len(valid)
+    if n<=target or target<3:
+        return valid
+    x,y=x[valid],y[valid]
+    edges=(np.arange(target-1)*(n-2)//(target-2)+1) #bucket edges for the middle points
+    edges=np.append(edges,n-1)
+    kept=np.empty(target,dtype=np.int64)
+    kept[0]=0
+    kept[-1]=n-1
+    a=0
+    for i in range(target-2):
+        lo,hi=edges[i],edges[i+1]
+        nlo,nhi=hi,edges[i+2] if i+2<len(edges) else n
+        if nhi<=nlo:
+            nlo,nhi=n-1,n
+        cx=x[nlo:nhi].mean()
+        cy=y[nlo:nhi].mean()
+        area=np.abs((x[a]-cx)*(y[lo:hi]-y[a])-(x[a]-x[lo:hi])*(cy-y[a]))
+        a=lo+int(np.argmax(area))
+        kept[i+1]=a
+    return valid[kept]
+
+
+def downsample(series,target=2000,method="minmax"):
+    """
+    Downsample a time series (pandas Series with a time index) to about target points
+    before plotting, method is "minmax" (min / max envelope) or "lttb".
+    Series already shorter than target are returned as they are.
+    """
+    if target is None or len(series)<=target:
+        return series
+    index=series.index
+    if isinstance(index,pd.DatetimeIndex):
+        x=index.asi8
+    else:
+        x=np.arange(len(series))
+    if method=="lttb":
+        kept=lttb(x,series.values,target)
+    else:
+        kept=minmaxbuckets(x,series.values,target)
+    return series.iloc[kept]
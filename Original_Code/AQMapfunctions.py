@@ -8,15 +8,11 @@ AQ Map fuctions libary for compter project
 #All the imports 
 import folium 
 from folium import plugins
-#needed to get plot in popup
-import vincent 
 import json
 import datetime
 import time
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
 #for random data generator
 import random
 import math
@@ -27,35 +23,22 @@ from folium.plugins import TimestampedGeoJson
 #color bars
 import branca.colormap as cm
 #import folium
-from folium import IFrame
-import mpld3
+from branca.element import MacroElement
+from jinja2 import Template
 import csv
 import sys
-
-
-#set varables for all fuctions 
-#colors used for the color bar and the data plots 
-colors=["tan","palegreen","greenyellow","green","yellow","orange","red","darkred","purple"]
-##colors=["grey","greenyellow","yellow","salmon","darkorange","red","darkorchid","purple"]
-
-colorbar_values=np.array([0,1,2,3,4,5,6,7,8,10])
-colorbar_max_value=12.00
-
-scaling = 1.0
-
-colorbar_values=colorbar_values/scaling
-colorbar_max_value=colorbar_max_value/scaling
-
-print(colorbar_values)
-print(colorbar_max_value)
-
-#if len(colorbar_values) != 11:  
-#   print("Error in colorbar_values length = ",len(colorbar_values))
-#   sys.exit()
-#
-if colorbar_max_value < colorbar_values[-1]:
-   print("Error in colorbar_max_value ",colorbar_max_value,colorbar_max[-1])
-
+import heapq
+import os
+import re
+import hashlib
+import logging
+from AQCache import codeversion, fingerprint, isfresh, stamp
+from AQTiming import timed, written
+#colour scales, kept in their own module so the tiles can use them without folium
+from AQColours import colors, colorbar_values, colorbar_max_value, scaling, colorscales, getscale
+
+logger=logging.getLogger(__name__)
+popupdir="Mapoutput" #folder of the map html, the popup chart and data are kept next to it
 
 #get data 
 def Walkdata(loc):
@@ -64,7 +47,7 @@ def Walkdata(loc):
         ##df=pd.read_csv(loc,header=4,error_bad_lines=False)
         df=pd.read_csv(loc,error_bad_lines=False)
         #df=pd.DataFrame({'time':data['time'] 'PM2':data['pm2'],'PM10':data['pm10'],'PM1':data['pm2'], 'RH':data['RH'],'lat':data['lat'],'lon':data['lon']})
-        print("Data check 1",df.head(1))
+        logger.debug('Data check 1 %s', df.head(1))
         #df.index=pd.to_datetime(df.index)
         df.set_index('time', inplace=True, drop=True)
         #print("Data check 2",df.head(3))
@@ -76,292 +59,722 @@ def Walkdata(loc):
             for row in reader:
                 i=i+1
                 if i<5:
-                    print(row)
+                    logger.debug('%s', row)
                     rowinfo=rowinfo=list(filter(None,row[1:5]))
                     info[row[0]]=rowinfo
                     
                     
         return df, info
     except Exception as e:
-             print("Error in reading file ",loc," /n please check file")
-             print('Error on line {}'.format(sys.exc_info()[-1].tb_lineno))
-             print(type(e))
-             print(e.args)
+             logger.error('Error in reading file %s /n please check file', loc)
+             logger.debug('Error details', exc_info=True)
              
 
 # vectorized haversine function
+def trackdist(lat,lon,times=None,groups=None):
+    """
+    Distance (m), speed (m/s) and heading (degrees from north) from each point to the next one,
+    for the whole track in one pass over shifted arrays.
+    times (optional) are the point times, needed for the speed.
+    groups (optional) is a label for each point (i.e. the walk name), no distance is
+    made between points of diffrent groups, so many walks can be done in one batch.
+    The last point of each track / group is nan.
+    """
+    earth_radius=6371
+    lat=np.radians(np.asarray(lat,dtype=float))
+    lon=np.radians(np.asarray(lon,dtype=float))
+    lat1,lat2=lat[:-1],lat[1:]
+    dlat=lat2-lat1
+    dlon=lon[1:]-lon[:-1]
+    a = np.sin((dlat)/2.0)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((dlon)/2.0)**2
+    dist=np.full(len(lat),np.nan)
+    dist[:-1]=earth_radius * 2 * np.arcsin(np.sqrt(a))*1000
+    #initial bearing to the next point
+    heading=np.full(len(lat),np.nan)
+    y=np.sin(dlon)*np.cos(lat2)
+    x=np.cos(lat1)*np.sin(lat2)-np.sin(lat1)*np.cos(lat2)*np.cos(dlon)
+    heading[:-1]=np.degrees(np.arctan2(y,x))%360
+    speed=np.full(len(lat),np.nan)
+    if times is not None:
+        seconds=np.asarray(pd.to_datetime(times).values,dtype="datetime64[ns]").astype("int64")/1e9
+        dtime=np.diff(seconds)
+        with np.errstate(divide="ignore",invalid="ignore"):
+            speed[:-1]=np.where(dtime>0,dist[:-1]/dtime,np.nan)
+    if groups is not None:
+        groups=np.asarray(groups)
+        end=np.append(groups[1:]!=groups[:-1],True)
+        dist[end]=np.nan
+        heading[end]=np.nan
+        speed[end]=np.nan
+    return dist,speed,heading
+
+
+@timed()
 def gendist(data):
     """
     Genrate the distance between two point and add them as a new row called dist
-
+    Also adds the speed and heading to the next point, see trackdist.
+    If the index is a time index it is used for the speed.
     """ 
-    earth_radius=6371
-    
-    diffs=[]
-    #reset indec, to get the number not time 
-    print("gendist")
-    print(data["lat"].iloc[3])
-    for ind in range(0,len(data)):
-       # print(ind)
-        #if not first point and last point
-        try:
-            if ind != 0 and ind != len(data)-1:
-              #  print(data["lat"][ind])
-                lat1=data["lat"].iloc[ind]
-                lat2=data["lat"].iloc[ind+1]
-                lon1=data["lon"].iloc[ind]
-                lon2=data["lon"].iloc[ind+1]
-            
-                lat1, lon1, lat2, lon2 = np.radians([lat1, lon1, lat2, lon2])
-                dlat=lat2-lat1
-                dlon=lon2-lon1
-                a = np.sin((dlat)/2.0)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((dlon)/2.0)**2
-                diff=earth_radius * 2 * np.arcsin(np.sqrt(a))*1000
-            else:
-                diff="nan"
-            diffs.append(diff)
-        except IndexError: 
-            diff="nan"
-            diffs.append(diff)
-        except Exception as e:
-             print("Error in GPS distance, check columns names")
-             print('Error on line {}'.format(sys.exc_info()[-1].tb_lineno))
-             print(type(e))
-             print(e.args)
-             pass
-    data.insert(len(data.columns),"dist",diffs,True) 
-    
+    try:
+        times=data.index if isinstance(data.index,pd.DatetimeIndex) else None
+        dist,speed,heading=trackdist(data["lat"].values,data["lon"].values,times)
+    except KeyError as e:
+        logger.error('Error in GPS distance, check columns names')
+        logger.error('%s', e.args)
+        raise
+    data["dist"]=dist
+    data["speed"]=speed
+    data["heading"]=heading
     return data
 
-def Staticsitedate(df,val,location,m):
+
+def gendistdic(Datadic):
+    """
+    Batch version of gendist, does all the walks in a data dictionary in one pass
+    and adds the dist, speed and heading columns to each of them.
+    """
+    keys=list(Datadic.keys())
+    if not keys:
+        return Datadic
+    lat=np.concatenate([Datadic[k]["lat"].values for k in keys])
+    lon=np.concatenate([Datadic[k]["lon"].values for k in keys])
+    groups=np.repeat(np.arange(len(keys)),[len(Datadic[k]) for k in keys])
+    times=None
+    if all(isinstance(Datadic[k].index,pd.DatetimeIndex) for k in keys):
+        times=np.concatenate([Datadic[k].index.values for k in keys])
+    dist,speed,heading=trackdist(lat,lon,times,groups)
+    for i,k in enumerate(keys):
+        mask=groups==i
+        Datadic[k]["dist"]=dist[mask]
+        Datadic[k]["speed"]=speed[mask]
+        Datadic[k]["heading"]=heading[mask]
+    return Datadic
+
+def loadsites(Goefol="Data//GeoLocations.csv"):
+    """
+    Read the site GeoLocations file (Site, Lat, lon, Sensor, start date, end date, Link),
+    it is only read once and then kept in sites
+    """
+    if Goefol not in sites:
+       # Geolocs=pd.read_csv(Goefol,header=0,encoding = 'unicode_escape',error_bad_lines=False)
+        with codecs.open(Goefol, "br",encoding="utf8", errors='ignore') as file:
+            sites[Goefol] = pd.read_table(file, delimiter=",")
+    return sites[Goefol]
+
+sites={} #GeoLocations files read by loadsites
+
+
+def Staticsitedate(df,val,location,m,scale="default",Geolocs=None,outdir=popupdir):
     """
     Plot static data, take in the data df, 
     located the data in Geolocation from the file name and plot it
+    Geolocs: the site table, read with loadsites if not given
+    outdir: folder the map html is saved in, the popup chart files are written there (see popupdata)
     
     """
-    #get date from name in the GPS data 
-
-  #  print(df.head(5))
     #plot the data as popup
-    Goefol="Data//GeoLocations.csv"
-   # Geolocs=pd.read_csv(Goefol,header=0,encoding = 'unicode_escape',error_bad_lines=False)
-    with codecs.open(Goefol, "br",encoding="utf8", errors='ignore') as file:
-        Geolocs = pd.read_table(file, delimiter=",")
-    #Geolocs.set_index("Site")
-   # print(Geolocs)
+    if Geolocs is None:
+        Geolocs=loadsites()
     #find the site information in the Geolocsation
-    for i,ind in enumerate(Geolocs["Site"]):
-        if ind==location:
-           
-            try:
-                Lat=Geolocs["Lat"][i]
-                lon=Geolocs["lon"][i]
-                info={}
-                info["Site"]=Geolocs["Site"][i]
-                info["Sensor"]=Geolocs["Sensor"][i]
-                info["start date"]=Geolocs["start date"][i]
-                info["end date"]=Geolocs["end date"][i]
-                info["Link"]=Geolocs["Link"][i]
-                print("siteinfo",Lat,lon)
-            except:
-                print("Site infromation error")
-                pass
-            
-            try:
-                popup=plotdataPopInfo(df,val,info)
-            except:
-                print("Popup error")
-                popup=info["Site"]
-            folium.Marker(location=[Lat,lon],
-            popup=popup,
-            #get icon and color based of mean value , of the first value
-            icon=folium.Icon(color= genfill_color(df[val[0]].mean(),100))
-            ).add_to(m)
-            print("Markger Generated")
+    for i,row in Geolocs[Geolocs["Site"]==location].iterrows():
+        try:
+            Lat=row["Lat"]
+            lon=row["lon"]
+            info={}
+            info["Site"]=row["Site"]
+            info["Sensor"]=row["Sensor"]
+            info["start date"]=row["start date"]
+            info["end date"]=row["end date"]
+            info["Link"]=row["Link"]
+            logger.debug('siteinfo %s %s', Lat, lon)
+        except:
+            logger.error('Site infromation error')
+            pass
+        
+        try:
+            popup=plotdataPopInfo(df,val,info,outdir)
+        except:
+            logger.error('Popup error')
+            popup=info["Site"]
+        folium.Marker(location=[Lat,lon],
+        popup=popup,
+        #get icon and color based of mean value , of the first value
+        icon=folium.Icon(color= genfill_color(df[val[0]].mean(),100,scale))
+        ).add_to(m)
+        logger.info('Markger Generated')
+
+
+class SiteIndex(object):
+    """
+    Spatial index over a set of points (i.e. the fixed sites, or the points of a walk),
+    using a grid hash on the local projected coordinates (m, see projectlatlon).
+    nearest: nearest indexed point for each query point
+    within: indexed points within a radius of each query point
+    join: nearest indexed point within a radius for each query point
+    aggregate: stats of values at query points joined to their nearest indexed point
+    """
+    def __init__(self,lat,lon,names=None,cell=100):
+        self.lat=np.asarray(lat,dtype=float)
+        self.lon=np.asarray(lon,dtype=float)
+        self.names=np.arange(len(self.lat)) if names is None else np.asarray(names)
+        self.cell=cell
+        #projection origin used for the index and all the queries
+        self.lat0=np.nanmean(self.lat)
+        self.lon0=np.nanmean(self.lon)
+        self.x,self.y=projectlatlon(self.lat,self.lon,self.lat0,self.lon0)
+        #grid hash, the points sorted by their cell key
+        keys=self.cellkeys(self.x,self.y)
+        self.order=np.argsort(keys)
+        self.keys=keys[self.order]
+
+    def __repr__(self):
+        return "SiteIndex("+str(len(self.lat))+" points, "+str(self.cell)+" m cells)"
+
+    def cellkeys(self,x,y,di=0,dj=0):
+        """
+        int64 grid cell key of projected points, offset by di, dj cells
+        """
+        i=np.floor(np.asarray(x)/self.cell).astype(np.int64)+di
+        j=np.floor(np.asarray(y)/self.cell).astype(np.int64)+dj
+        return i*2**32+j
+
+    def project(self,lat,lon):
+        """
+        Project query points with the index origin
+        """
+        return projectlatlon(lat,lon,self.lat0,self.lon0)
+
+    def nearest(self,lat,lon):
+        """
+        Index and distance (m) of the nearest indexed point for each query point.
+        Keeps a running minimum over the indexed points, each step is one array operation
+        over all the query points, so it is meant for small indexes like the fixed sites,
+        use within for radius queries on big indexes.
+        """
+        qx,qy=self.project(lat,lon)
+        index=np.zeros(len(qx),dtype=np.int64)
+        best=np.full(len(qx),np.inf)
+        d2=np.empty(len(qx))
+        dy=np.empty(len(qx))
+        closer=np.empty(len(qx),dtype=bool)
+        for k in np.flatnonzero(~np.isnan(self.x)):
+            np.subtract(qx,self.x[k],out=d2)
+            np.multiply(d2,d2,out=d2)
+            np.subtract(qy,self.y[k],out=dy)
+            np.multiply(dy,dy,out=dy)
+            np.add(d2,dy,out=d2)
+            np.less(d2,best,out=closer)
+            np.copyto(best,d2,where=closer)
+            np.copyto(index,k,where=closer)
+        dist=np.sqrt(best)
+        dist[np.isinf(dist)]=np.nan
+        return index,dist
+
+    def within(self,lat,lon,radius):
+        """
+        For each query point, the index of the indexed points within radius (m).
+        Only the grid cells around each query point are searched.
+        """
+        qx,qy=self.project(np.atleast_1d(lat),np.atleast_1d(lon))
+        reach=int(np.ceil(radius/self.cell))
+        found=[]
+        for x,y in zip(qx,qy):
+            parts=[]
+            for di in range(-reach,reach+1):
+                #the cells of one grid column are next to each other in the sorted keys
+                lo=np.searchsorted(self.keys,self.cellkeys(x,y,di,-reach),side="left")
+                hi=np.searchsorted(self.keys,self.cellkeys(x,y,di,reach),side="right")
+                parts.append(self.order[lo:hi])
+            cand=np.concatenate(parts)
+            d=np.hypot(self.x[cand]-x,self.y[cand]-y)
+            found.append(np.sort(cand[d<=radius]))
+        return found
+
+    def join(self,lat,lon,radius):
+        """
+        Nearest indexed point (site) within radius (m) for each query point (i.e. walk readings),
+        returns its index (-1 if there is none) and the distance (nan if there is none).
+        The query points get their own grid hash and only the cells around each indexed
+        point are searched, so joining a whole walk to the sites only costs one sort.
+        """
+        lat=np.asarray(lat,dtype=float)
+        lon=np.asarray(lon,dtype=float)
+        index=np.full(len(lat),-1,dtype=np.int64)
+        dist=np.full(len(lat),np.nan)
+        ok=np.flatnonzero(~np.isnan(lat)&~np.isnan(lon))
+        if len(ok)==0 or len(self.lat)==0:
+            return index,dist
+        points=SiteIndex(lat[ok],lon[ok],cell=radius)
+        found=points.within(self.lat,self.lon,radius)
+        q=np.concatenate(found)
+        if len(q)==0:
+            return index,dist
+        k=np.repeat(np.arange(len(found)),[len(f) for f in found])
+        sx,sy=points.project(self.lat,self.lon)
+        d=np.hypot(points.x[q]-sx[k],points.y[q]-sy[k])
+        # keep the closest site for points near more than one
+        order=np.lexsort((d,q))
+        q,k,d=q[order],k[order],d[order]
+        first=np.concatenate(([True],q[1:]!=q[:-1]))
+        index[ok[q[first]]]=k[first]
+        dist[ok[q[first]]]=d[first]
+        return index,dist
+
+    def aggregate(self,lat,lon,values,radius,limit=25):
+        """
+        Join query points (i.e. walk readings) to their nearest indexed point (site) if it is
+        within radius (m), and return the mean, median, count and exceedance fraction of
+        the values for each indexed point that was passed.
+        """
+        values=np.asarray(values,dtype=float)
+        index,dist=self.join(lat,lon,radius)
+        mask=(index>=0)&~np.isnan(values)
+        cols=["Site","mean","median","count","exceed"]
+        if not mask.any():
+            return pd.DataFrame(columns=cols)
+        used,groups=np.unique(index[mask],return_inverse=True)
+        mean,median,count,exceed=groupstats(groups.ravel(),values[mask],limit)
+        return pd.DataFrame({"Site":self.names[used],"mean":mean,"median":median,
+                             "count":count,"exceed":exceed},columns=cols)
+
+
 
+def sitejoin(data,Geolocs=None,radius=100):
+    """
+    Add the nearest site within radius (m) ("Site") and the distance to it ("sitedist", m)
+    to each reading of a walk, both are nan when no site is within radius.
+    """
+    if Geolocs is None:
+        Geolocs=loadsites()
+    index=SiteIndex(Geolocs["Lat"].values,Geolocs["lon"].values,Geolocs["Site"].values)
+    near,dist=index.join(data["lat"].values,data["lon"].values,radius)
+    data["Site"]=np.where(near>=0,index.names[near].astype(object),np.nan)
+    data["sitedist"]=dist
+    return data
 
 
-def Stationrydata(data):
+def findruns(mask,breaks=None):
+    """
+    Start and stop (exclusive) index of each run of True values in a boolean array,
+    as a (runs x 2) array. breaks (optional) is a boolean array that is True where a
+    new run has to start even if the previous point is also True (i.e. a time gap).
+    """
+    mask=np.asarray(mask,dtype=bool)
+    prev=np.concatenate(([False],mask[:-1]))
+    nxt=np.concatenate((mask[1:],[False]))
+    starts=mask & ~prev
+    stops=mask & ~nxt
+    if breaks is not None:
+        breaks=np.asarray(breaks,dtype=bool)
+        starts=starts | (mask & breaks)
+        stops=stops | (mask & np.concatenate((breaks[1:],[False])))
+    return np.column_stack((np.flatnonzero(starts),np.flatnonzero(stops)+1))
+
+
+def segmenttrack(data,still=1.5,minpoints=5,gap=120):
+    """
+    Label each point of a GPS track as moving or stationary and split it into segments.
+    A point is stationary when it is in a run of more than minpoints steps shorter than
+    still (m), i.e. if you sat for 20mins outside, or chatted for 5 mins.
+    Stops, moves and trips are split where the time between two points is more than gap (s).
+    Uses the dist column if it is there, if not gendist is run.
+    Returns a dict with the "stationary" boolean array and the "stops", "moves" and "trips"
+    index ranges as (segments x 2) arrays of [start, stop), so no data is copied.
+    """
+    if "dist" in data.columns:
+        dist=data["dist"].values.astype(float)
+    else:
+        dist=trackdist(data["lat"].values,data["lon"].values)[0]
+    with np.errstate(invalid="ignore"):
+        slow=dist<still
+    #run length of the slow steps, keep the long ones
+    runs=findruns(slow)
+    long=runs[(runs[:,1]-runs[:,0])>minpoints]
+    stationary=np.zeros(len(data),dtype=bool)
+    if len(long):
+        #mark each long run with a +1/-1 and cumsum, so no loop over the runs
+        edges=np.zeros(len(data)+1,dtype=int)
+        np.add.at(edges,long[:,0],1)
+        np.add.at(edges,long[:,1],-1)
+        stationary=np.cumsum(edges[:-1])>0
+    breaks=np.zeros(len(data),dtype=bool)
+    if isinstance(data.index,pd.DatetimeIndex) and len(data):
+        seconds=np.asarray(data.index.values,dtype="datetime64[ns]").astype("int64")/1e9
+        breaks[1:]=np.diff(seconds)>gap
+    seg={}
+    seg["stationary"]=stationary
+    seg["stops"]=findruns(stationary,breaks)
+    seg["moves"]=findruns(~stationary,breaks)
+    seg["trips"]=findruns(np.ones(len(data),dtype=bool),breaks)
+    return seg
+
+
+def Stationrydata(data,still=1.5,minpoints=5,gap=120):
     """
     Fuction: Run through GPS data files, find stationry data cuts its of the old data.
-    Then it run though the Stationry data to find if there are multiple statiory spots,
-    if so it splits the stationory data into dic elements.
-    
-    
+    Uses segmenttrack, the stationary periods split on time gaps are in segmenttrack(data)["stops"].
+    Returns the moving data and the stationary data
     """
-    
-    
     #get dist data
-    data=gendist(data)  #get the date
-    print("Distance", data["dist"])
-    Statdata=pd.DataFrame(index=data.index,columns=data.columns) #create a stationy data frame array
-  #  Nanlatlon=pd.DataFrame(index=data.index,columns=data.columns) #create a GPS error dataframe array
-    #pDataFrame(columns=data.columns)
-    a=0 #set an index for the save
-    #loop through the data
-    try:
-    
-        for index,row in data.iterrows():
-            
-            diff=row["dist"]
-           # print(diff)
-            if diff != "nan":
-                save=pd.DataFrame(index=data.index,columns=data.columns)
-               # rec="on"
-                if diff<1.5:
-                    #dict1.update()
-                    a=a+1
-                    save.append(row)
-                    if a>5: #if 5 stationry points in row
-           
-                        Statdata.loc[index]=row      
-                else:
-                    a=0 #reset index
-    
-        print("Stationary Data")
-        print(Statdata.head(1))
-        
-        
-        Newdata=Statdata[Statdata['dist'].notnull()]
-        #cut the data from old array
-        data=data[Statdata['dist'].isnull()]
-     # checks 
-      #  print("OldD",data.head(4))
-       # print("NewD",Newdata.head(4))
-        
-  
-     #of there is some still data 
-          #chaeck if Still data is close to one another in time
-        #If it is split the data into diffrenct section
-        Stilldic={} #dic to add the splits
-    
-        Satname="Sat" #place holdername
-        satnum=1 #set number to add to satname for diffrent station data sets 
-        saveindex=0 #set a index to deal with multiple silld
-        
-        save=Newdata.index[0] #place holder to get the function working
-        for index,row in Newdata.iterrows():
-            if index != 0:
-                timediff=divmod((index-save).total_seconds(),60)
-                if timediff[1] >120: #if greater than 2 mins split
-                    #add to still data to dic
-                    Stilldic[Satname+str(satnum)]=pd.DataFrame(Newdata.ilox[saveindex:index])
-                    satnum=satnum+1 #add to the satnum
-            #save the index for next interval
-            save=index
-        if len(Stilldic) <1: # if there only 1 sill data, then add it to the dict. This is to make future code what loop through a dic easyer
-            Stilldic[Satname]=Newdata
-        print("Got GPS Stationy data")
-           # print(Newdata.head(3))
-    except Exception as e:
-         print("No stationry GPS data ")
-         print('Error on line {}'.format(sys.exc_info()[-1].tb_lineno))
-         print(type(e))
-         print(e.args)
-         pass
+    if "dist" not in data.columns:
+        data=gendist(data)
+    seg=segmenttrack(data,still,minpoints,gap)
+    Newdata=data[seg["stationary"]]
+    #cut the data from old array
+    data=data[~seg["stationary"]]
+    logger.info('Got GPS Stationy data, %s stops', len(seg["stops"]))
     return data, Newdata
 
+#spatial gridding
+earth_radius_m=6371000.0
+
+def projectlatlon(lat,lon,lat0,lon0):
+    """
+    Project lat / lon onto a local flat grid in m around lat0, lon0 (equirectangular),
+    good enough for the few km of a walk or a city.
+    """
+    lat=np.asarray(lat,dtype=float)
+    lon=np.asarray(lon,dtype=float)
+    x=np.radians(lon-lon0)*earth_radius_m*np.cos(np.radians(lat0))
+    y=np.radians(lat-lat0)*earth_radius_m
+    return x,y
+
+
+def unprojectlatlon(x,y,lat0,lon0):
+    """
+    Inverse of projectlatlon
+    """
+    lat=lat0+np.degrees(np.asarray(y,dtype=float)/earth_radius_m)
+    lon=lon0+np.degrees(np.asarray(x,dtype=float)/(earth_radius_m*np.cos(np.radians(lat0))))
+    return lat,lon
+
+
+def groupstats(groups,values,limit):
+    """
+    mean, median, count and exceedance fraction (values > limit) of values for each
+    group number (0 to n-1), all with numpy grouping, no loop over the groups.
+    """
+    count=np.bincount(groups)
+    mean=np.bincount(groups,weights=values)/count
+    exceed=np.bincount(groups,weights=(values>limit).astype(float))/count
+    #sort by group then value, the median is in the middle of each group
+    order=np.lexsort((values,groups))
+    svalues=values[order]
+    start=np.concatenate(([0],np.cumsum(count)[:-1]))
+    median=(svalues[start+(count-1)//2]+svalues[start+count//2])/2
+    return mean,median,count,exceed
+
+
+def gridcells(lat,lon,values,cell=50,shape="square",limit=25,keys=None):
+    """
+    Aggregate GPS tagged readings into fixed size square or hexagonal ("hex") cells.
+    cell is the cell size in m (the side of a square, the distance between hex centres).
+    limit is the value used for the exceedance fraction (25 ug/m^3 = WHO 24 hour PM2.5 guideline).
+    keys (optional) is an extra group for each reading, i.e. a time bin, so each cell
+    is done for each key.
+    Returns a DataFrame with one row per cell: the cell centre lat / lon,
+    mean, median, count and exceed (fraction of readings above limit), plus key.
+    """
+    lat=np.asarray(lat,dtype=float)
+    lon=np.asarray(lon,dtype=float)
+    values=np.asarray(values,dtype=float)
+    mask=~np.isnan(lat) & ~np.isnan(lon) & ~np.isnan(values)
+    lat,lon,values=lat[mask],lon[mask],values[mask]
+    cols=["lat","lon","mean","median","count","exceed"]
+    if keys is not None:
+        keys=np.asarray(keys)[mask]
+        cols=cols+["key"]
+    if len(values)==0:
+        return pd.DataFrame(columns=cols)
+    lat0=np.mean(lat)
+    lon0=np.mean(lon)
+    x,y=projectlatlon(lat,lon,lat0,lon0)
+    if shape=="hex":
+        #pointy top hexagons in axial coordinates, then cube rounding
+        R=cell/np.sqrt(3)
+        q=(np.sqrt(3)/3*x-y/3)/R
+        r=(2/3*y)/R
+        z=-q-r
+        rq,rr,rz=np.round(q),np.round(r),np.round(z)
+        dq,dr,dz=np.abs(rq-q),np.abs(rr-r),np.abs(rz-z)
+        rq=np.where((dq>dr)&(dq>dz),-rr-rz,rq)
+        rr=np.where(~((dq>dr)&(dq>dz))&(dr>dz),-rq-rz,rr)
+        i,j=rq.astype(np.int64),rr.astype(np.int64)
+    else:
+        i=np.floor(x/cell).astype(np.int64)
+        j=np.floor(y/cell).astype(np.int64)
+    if keys is not None:
+        keyvals,k=np.unique(keys,return_inverse=True)
+    else:
+        k=np.zeros(len(i),dtype=np.int64)
+    #one int64 id for each cell (and key), so the grouping is a single 1-D unique
+    i0,j0=i.min(),j.min()
+    ni,nj=i.max()-i0+1,j.max()-j0+1
+    cellid=(k*ni+(i-i0))*nj+(j-j0)
+    uid,groups=np.unique(cellid,return_inverse=True)
+    groups=groups.ravel()
+    mean,median,count,exceed=groupstats(groups,values,limit)
+    ci=(uid//nj%ni+i0).astype(float)
+    cj=(uid%nj+j0).astype(float)
+    if shape=="hex":
+        cx=R*np.sqrt(3)*(ci+cj/2)
+        cy=R*1.5*cj
+    else:
+        cx=(ci+0.5)*cell
+        cy=(cj+0.5)*cell
+    clat,clon=unprojectlatlon(cx,cy,lat0,lon0)
+    cells=pd.DataFrame({"lat":clat,"lon":clon,"mean":mean,"median":median,"count":count,"exceed":exceed},columns=cols)
+    if keys is not None:
+        cells["key"]=keyvals[uid//(ni*nj)]
+    return cells
+
+
+def cellpolygon(lat,lon,cell=50,shape="square"):
+    """
+    GeoJson coordinates ([lon,lat] ring) of a grid cell from its centre
+    """
+    if shape=="hex":
+        R=cell/np.sqrt(3)
+        angles=np.radians(np.arange(30,390,60))
+        x,y=R*np.cos(angles),R*np.sin(angles)
+        x,y=np.append(x,x[0]),np.append(y,y[0]) #close the ring
+    else:
+        h=cell/2
+        x,y=np.array([-h,h,h,-h,-h]),np.array([-h,-h,h,h,-h])
+    plat,plon=unprojectlatlon(x,y,lat,lon)
+    return [[float(a),float(b)] for a,b in zip(plon,plat)]
+
+
+def gridfeatures(cells,cell=50,shape="square",val="mean",scale="default"):
+    """
+    GeoJson polygon features for the cells from gridcells, coloured by the val statistic.
+    If the cells have a key it is used as the feature time (for TimestampedGeoJson).
+    """
+    features=[]
+    cellcolors=genfill_colors(cells[val],scale)
+    for row,color in zip(cells.itertuples(index=False),cellcolors):
+        row=row._asdict()
+        props={"mean":round(row["mean"],2),"median":round(row["median"],2),
+               "count":int(row["count"]),"exceed":round(row["exceed"],2),
+               "style":{"color":color,"fillColor":color,"fillOpacity":0.7,"weight":1}}
+        if "key" in row:
+            props["time"]=str(row["key"])
+        features.append({"type":"Feature",
+                         "geometry":{"type":"Polygon","coordinates":[cellpolygon(row["lat"],row["lon"],cell,shape)]},
+                         "properties":props})
+    return features
+
+
+#track simplification
+def segmentdeviation(P,i,j):
+    """
+    Largest distance of the points between i and j from the straight line i-j
+    (P is a points x dims array), returns the distance and the point index.
+    """
+    A=P[i]
+    AB=P[j]-A
+    AP=P[i+1:j]-A
+    L=np.dot(AB,AB)
+    if L==0:
+        d=np.sqrt((AP**2).sum(axis=1))
+    else:
+        #distance to the line = length of the part of AP not along AB
+        t=AP.dot(AB)/L
+        d=np.sqrt(((AP-np.outer(t,AB))**2).sum(axis=1))
+    k=int(np.argmax(d))
+    return d[k],i+1+k
+
+
+def simplifytrack(lat,lon,values=None,maxpoints=2000,tolerance=0,peaks=None,vscale=None):
+    """
+    Pick the points to keep so a track can be drawn with at most maxpoints features,
+    keeping the route shape and the PM peaks.
+    Douglas-Peucker on the projected track (m) with the value as a 3rd dimension
+    (value * vscale m, by default scaled so the value range is the track size), the most
+    important splits are taken first so it stops at maxpoints or when the deviation is
+    below tolerance (m).
+    On top of that the peaks highest values are always kept (default maxpoints/20).
+    Returns the sorted index of the points to keep.
+    """
+    lat=np.asarray(lat,dtype=float)
+    lon=np.asarray(lon,dtype=float)
+    n=len(lat)
+    if n<=max(maxpoints,2):
+        return np.arange(n)
+    x,y=projectlatlon(lat,lon,np.nanmean(lat),np.nanmean(lon))
+    cols=[x,y]
+    keep=[0,n-1]
+    if values is not None:
+        values=np.asarray(values,dtype=float)
+        v=np.where(np.isnan(values),np.nanmean(values),values)
+        if peaks is None:
+            peaks=maxpoints//20
+        if peaks>0:
+            keep=keep+list(np.argsort(v)[-peaks:])
+        if vscale is None:
+            vrange=np.ptp(v)
+            vscale=max(np.ptp(x),np.ptp(y))/vrange if vrange>0 else 0
+        cols.append(v*vscale)
+    P=np.column_stack(cols)
+    chosen=set(keep)
+    #max heap of segments by their deviation
+    heap=[]
+    d,k=segmentdeviation(P,0,n-1)
+    heap.append((-d,0,n-1,k))
+    while heap and len(chosen)<maxpoints:
+        d,i,j,k=heapq.heappop(heap)
+        if -d<=tolerance:
+            break
+        chosen.add(k)
+        for a,b in ((i,k),(k,j)):
+            if b-a>1:
+                dd,kk=segmentdeviation(P,a,b)
+                heapq.heappush(heap,(-dd,a,b,kk))
+    return np.array(sorted(chosen))
+
+
 #color map
-def colormap(m,index,caption):
+def colormap(m,index,caption,scale="default"):
     """
     Def a color map, need the map m, an array of colors with a matching index and caption for the name.
+    The colors and index come from the colour scale (see colorscales).
     """
 
     
     #CB= cm.StepColormap(colors, vmin=0,vmax=10,index=index,  caption=caption )
-    
-    print("in colormap colorbar_values=",colorbar_values[0],colorbar_max_value)
-    print(colorbar_values)
-
-    CB= cm.StepColormap(colors, vmin=colorbar_values[0],vmax=colorbar_max_value,index=colorbar_values[:],  caption=caption )
+    sc=getscale(scale)
+    CB= cm.StepColormap(sc["colors"], vmin=sc["values"][0],vmax=sc["max"],index=list(sc["values"][:]),  caption=caption )
     m.add_child(CB)
 
 
-def genfill_color(val,ref):
+def genfill_colors(vals,scale="default"):
+    """
+    Vectorized genfill_color, classifies a whole array / series of values in one searchsorted call.
+    Returns an array of colours, values below or above the scale get its under / over colour
+    and nan values its nan colour.
+    """
+    sc=getscale(scale)
+    vals=np.asarray(vals,dtype=float)
+    ncol=len(sc["colors"])
+    index=np.searchsorted(np.asarray(sc["values"],dtype=float),vals,side="right")-1
+    index=np.where(index>=ncol,ncol+1,index)
+    index=np.where(index<0,ncol,index)
+    index=np.where(np.isnan(vals),ncol+2,index)
+    palette=np.array(list(sc["colors"])+[sc["under"],sc["over"],sc["nan"]],dtype=object)
+    return palette[index]
+
+
+def genfill_color(val,ref,scale="default"):
     """
     Generate colors for to fill cirles based on data values
-    need a color lits and index defined before the use 
+    Single value version of genfill_colors, use that for a whole series.
     
     """
-    print("")
-    print("")
-    print("colors=",colors)
-    print("colorbar_values = ",colorbar_values)
-    print("val = ",val)
-    index_temp = np.where(colorbar_values[:] > val)[0]
-    print("index_temp=",index_temp)
-    print("")
+    return genfill_colors([val],scale)[0]
 
-    try:
-       col=colors[index_temp[0]-1]
-    except:
-       print("Value out of range val = ",val)
-       print("")
-       print("")
-       print("")
-       print("")
-       col="black"
-
-#    col=""
-    try:
-      print("KP col = ",col)
-#        if val <= 0.05:
-#            col=colors[0]
-#        elif (val >= 0.05 and val <0.1):
-#            col=colors[1]
-#        elif (val >0.1 and val <0.15):
-#            col=colors[2]    
-#        elif (val >0.15 and val <0.20):
-#            col=colors[3]
-##        elif (val >= 0.20 and val <0.25):
- #           col=colors[4]
- #       elif (val >= 0.25 and val <0.3):
-#            col=colors[5]    
-#        elif(val >=0.3 and val <0.4 ):
-#            col=colors[6]
-#        elif val>0.4:
-#            col=colors[7]
-      return col
-    except  Exception as e:
-                    print("Error in  genfill_color")
-#                    print('Error on line {}'.format(sys.exc_info()[-1].tb_lineno))
-#                    print(type(e))
-#                    print(e.args)
-#                    pass
 
-
-def GenPMCircles(data,val,group,outlinecolor):
+class PMPointLayer(MacroElement):
+    """
+    All the points of a walk as one canvas drawn GeoJson layer.
+    Each feature only holds its position, id and colour number, the colours come from a
+    shared palette and the popup text is made on click from the popup columns by feature id.
+    Add it to a FeatureGroup (or the map) like any other folium object.
+    """
+    _template = Template(u"""
+        {% macro script(this, kwargs) %}
+            var {{this.get_name()}}_palette = {{this.palette}};
+            var {{this.get_name()}}_popups = {{this.popups}};
+            var {{this.get_name()}}_renderer = L.canvas();
+            var {{this.get_name()}} = L.geoJson({{this.data}}, {
+                pointToLayer: function (feature, latlng) {
+                    var color = {{this.get_name()}}_palette[feature.properties.c];
+                    return L.circle(latlng, {radius: {{this.radius}}, color: color, fillColor: color,
+                        fillOpacity: 0.8, opacity: 0.9, renderer: {{this.get_name()}}_renderer});
+                }
+            }).bindPopup(function (layer) {
+                var p = {{this.get_name()}}_popups;
+                var i = layer.feature.id;
+                var html = "Time <br>" + p.time[i];
+                for (var k in p.values) {
+                    html = html + " " + k + ":" + p.values[k][i];
+                }
+                return html;
+            }).addTo({{this._parent.get_name()}});
+        {% endmacro %}
+        """)
+
+    def __init__(self,lat,lon,fill_colors,popups,radius=8):
+        super(PMPointLayer, self).__init__()
+        self._name = "PMPointLayer"
+        palette,index=np.unique(np.asarray(fill_colors,dtype=str),return_inverse=True)
+        lon=np.round(np.asarray(lon,dtype=float),6).tolist()
+        lat=np.round(np.asarray(lat,dtype=float),6).tolist()
+        template='{"type":"Feature","id":%d,"geometry":{"type":"Point","coordinates":[%r,%r]},"properties":{"c":%d}}'
+        features=[template % (i,x,y,c) for i,(x,y,c) in enumerate(zip(lon,lat,index.ravel().tolist()))]
+        self.data=featurecollection(features)
+        self.palette=json.dumps(palette.tolist())
+        self.popups=json.dumps(popups,separators=(",",":"))
+        self.radius=radius
+
+
+def GenPMCircles(data,val,group,outlinecolor,maxpoints=None,scale="default",layer=True):
     """
     Generate walk map data as circles data, need data, the varaibles and the map group i.e for diffrent dates 
     And an outlinecolor for 
+    maxpoints: if set the walk is simplified to at most maxpoints circles (see simplifytrack)
+    scale: colour scale name (see colorscales)
+    layer: draw all the circles as one PMPointLayer, False for one folium.Circle per row
     """
     data=data.dropna()
+    if maxpoints and len(data)>maxpoints:
+        data=data.iloc[simplifytrack(data["lat"],data["lon"],data[val],maxpoints)]
     try:
-        for index,row in data.iterrows():   
-            ref=100
+        fill_colors=genfill_colors(data[val],scale)
+        if layer:
+            #popup columns, looked up by feature id when clicked
+            popups={"time":pd.Index(data.index).astype(str).tolist(),"values":{}}
+            popups["values"][val+" (ug/m^3)"]=np.round(data[val].values.astype(float),2).tolist()
+            if "DHT-T" in data.columns:
+                popups["values"]["Temp (C)"]=np.round(data["DHT-T"].values.astype(float),2).tolist()
+            if "DHT-RH" in data.columns:
+                popups["values"]["RH (%)"]=np.round(data["DHT-RH"].values.astype(float),1).tolist()
+            PMPointLayer(data["lat"],data["lon"],fill_colors,popups).add_to(group)
+            return
+        for (index,row),fill_color in zip(data.iterrows(),fill_colors):   
             folium.Circle(location=[row['lat'],row['lon']],
             radius=8,
             popup=("Time <br>"+str(index)+" "+val+"+:"+str(round(row[val],2))+"ug/m^2"+" Temp:"+str(round(row['DHT-T'],2))+"C"+" RH:"+str(round(row['DHT-RH'],1))+"(%)"),
-            fill_color=genfill_color(row[val],ref),
-            color=genfill_color(row[val],ref),
+            fill_color=fill_color,
+            color=fill_color,
             fill_opacity=0.8,
             opacity=0.9,
             ).add_to(group)
     except  Exception as e:
                     
-                    print("-----------Error in GPS Data cirlce generation----------")
-                    print(val)
-                    print('Error on line {}'.format(sys.exc_info()[-1].tb_lineno))
-                    print(type(e))
-                    print(e.args)
+                    logger.error('Error in GPS Data cirlce generation %s', val)
+                    logger.debug('Error details', exc_info=True)
                     pass    
 
 
 
-def DataCircle(df,lat, lon,group,val):
+def GenPMGrid(data,val,group,cell=50,shape="square",limit=25,scale="default"):
+    """
+    Grid version of GenPMCircles, the data are aggregated into cells (see gridcells) and
+    drawn as one GeoJson layer in the group, coloured by the cell mean.
+    """
+    cells=gridcells(data["lat"],data["lon"],data[val],cell,shape,limit)
+    folium.GeoJson({"type":"FeatureCollection","features":gridfeatures(cells,cell,shape,scale=scale)},
+                   style_function=lambda feature: feature["properties"]["style"],
+                   tooltip=folium.GeoJsonTooltip(fields=["mean","median","count","exceed"])
+                   ).add_to(group)
+    return cells
+
+
+def DataCircle(df,lat, lon,group,val,outdir=popupdir):
     """
     Data circle fuction but this time iver with a data plot of mean data 
-    
+    outdir: folder the map html is saved in (see popupdata)
     
     """
     #generate data cirles with plots of the data or mean depending on length
@@ -388,29 +801,27 @@ def DataCircle(df,lat, lon,group,val):
             #if more than 10 data points, plot the time series of the data
            
             folium.Circle(location=[lat,lon],
-            popup=plotdataPop(df,val),
+            popup=plotdataPop(df,val,outdir),
             radius=10, fill=True,color='black'
         ).add_to(group)
     except  Exception as e:
-                    print("Error in GPS Data cirlce generation")
-                    print('Error on line {}'.format(sys.exc_info()[-1].tb_lineno))
-                    print(type(e))
-                    print(e.args)
+                    logger.error('Error in GPS Data cirlce generation')
+                    logger.debug('Error details', exc_info=True)
                     pass
     
-def DataMarker(df,val,lat, lon,group):
+def DataMarker(df,val,lat, lon,group,scale="default",outdir=popupdir):
     
     folium.Marker(location=[lat,lon],
-    popup=plotdataPop(df,val),
-    icon=folium.Icon(color= genfill_color(df[val[0]].mean(),100))
+    popup=plotdataPop(df,val,outdir),
+    icon=folium.Icon(color= genfill_color(df[val[0]].mean(),100,scale))
 ).add_to(group)
 
 
-def DataMarkerInfo(df,val,lat, lon,group,info):
+def DataMarkerInfo(df,val,lat, lon,group,info,scale="default",outdir=popupdir):
     
     folium.Marker(location=[lat,lon],
-    popup=plotdataPopInfo(df,val,info),
-    icon=folium.Icon(color= genfill_color(df[val[0]].mean(),100))
+    popup=plotdataPopInfo(df,val,info,outdir),
+    icon=folium.Icon(color= genfill_color(df[val[0]].mean(),100,scale))
 ).add_to(group)   
 
 
@@ -431,51 +842,142 @@ def GenCount(data):
     return data
 
 
-def plotdataPopInfo(df,vals,info):
+popcharts=set() #popchart.html files written by this run
+
+def popupdata(df,vals,title="",outdir=popupdir,maxpoints=500):
+    """
+    Write the data for a marker popup chart as a small script file in outdir, the folder
+    the map html is saved in, as the popup frames load the chart and data from next to the map.
+    The data are a script (not JSON read with fetch) so the map also works opened as a file
+    with no web server, keep the popchart.html and popdata_*.js files with the map.
+    The readings are averaged down to at most maxpoints points.
+    The file is named from the data so the same data is only written once.
+    Returns the file name
+    """
+    df=df[vals]
+    if len(df)>maxpoints: #mean over runs of readings, timed at the first reading of the run
+        runs=np.arange(len(df))*maxpoints//len(df)
+        times=pd.DatetimeIndex(df.index)[np.flatnonzero(np.diff(runs,prepend=-1))]
+        df=df.groupby(runs).mean().set_index(times)
+    name="popdata_"+datahash(df,title)[:16]+".js"
+    genpopchart(outdir)
+    filename=os.path.join(outdir,name)
+    if not os.path.exists(filename):
+        data={"title":title,
+              "t":np.asarray(df.index,dtype="datetime64[ms]").astype(np.int64).tolist(),
+              "series":{val:[None if np.isnan(v) else round(float(v),2) for v in df[val].values] for val in vals}}
+        with open(filename,"w") as f:
+            f.write("popdata("+json.dumps(data,separators=(",",":"))+");")
+    return name
+
+
+def popupframe(name,width=300,height=320):
+    """
+    iframe html showing the popup chart of a popupdata file, the chart page and
+    data are only loaded when the popup is opened
+    """
+    return ("<iframe src='popchart.html#"+name+"' width='"+str(width)+"' height='"+str(height)+
+            "' style='border:none;display:block;'></iframe>")
+
+
+def genpopchart(outdir=popupdir):
+    """
+    Write popchart.html in outdir (once a run), the page shared by all the popups,
+    it loads the data file named after the # of its url (see popupdata) and draws it as a line chart
+    """
+    filename=os.path.join(outdir,"popchart.html")
+    if filename in popcharts:
+        return filename
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    html="""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<style>
+body { margin: 0; font: 11px sans-serif; }
+svg text { font: 11px sans-serif; }
+</style>
+</head>
+<body>
+<svg id="chart"></svg>
+<script>
+var colors = ["#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd"];
+function el(tag, attrs, parent) {
+    var e = document.createElementNS("http://www.w3.org/2000/svg", tag);
+    for (var k in attrs) { e.setAttribute(k, attrs[k]); }
+    parent.appendChild(e);
+    return e;
+}
+function hhmm(ms) {
+    var d = new Date(ms);
+    return ("0" + d.getUTCHours()).slice(-2) + ":" + ("0" + d.getUTCMinutes()).slice(-2);
+}
+function popdata(data) {
+    var W = window.innerWidth, H = window.innerHeight, L = 40, R = 8, T = 20, B = 34;
+    var svg = document.getElementById("chart");
+    svg.setAttribute("width", W);
+    svg.setAttribute("height", H);
+    var names = Object.keys(data.series), lo = Infinity, hi = -Infinity;
+    names.forEach(function (n) {
+        data.series[n].forEach(function (v) { if (v !== null) { lo = Math.min(lo, v); hi = Math.max(hi, v); } });
+    });
+    if (!isFinite(lo)) { lo = 0; hi = 1; }
+    if (hi == lo) { hi = lo + 1; }
+    var t0 = data.t[0], t1 = data.t[data.t.length - 1] || t0 + 1;
+    if (t1 == t0) { t1 = t0 + 1; }
+    function x(t) { return L + (t - t0) / (t1 - t0) * (W - L - R); }
+    function y(v) { return H - B - (v - lo) / (hi - lo) * (H - T - B); }
+    for (var i = 0; i <= 4; i++) {
+        var v = lo + (hi - lo) * i / 4, t = t0 + (t1 - t0) * i / 4;
+        el("line", {x1: L, x2: W - R, y1: y(v), y2: y(v), stroke: "#ddd"}, svg);
+        el("text", {x: L - 3, y: y(v) + 4, "text-anchor": "end"}, svg).textContent = v.toFixed(1);
+        el("text", {x: x(t), y: H - B + 14, "text-anchor": "middle"}, svg).textContent = hhmm(t);
+    }
+    el("text", {x: L, y: 13}, svg).textContent = data.title;
+    names.forEach(function (n, j) {
+        var d = "", pen = "M";
+        data.series[n].forEach(function (v, i) {
+            if (v === null) { pen = "M"; return; }
+            d += pen + x(data.t[i]).toFixed(1) + "," + y(v).toFixed(1);
+            pen = "L";
+        });
+        el("path", {d: d, fill: "none", stroke: colors[j % colors.length], "stroke-width": 1.2}, svg);
+        el("text", {x: L + 6 + j * 90, y: H - 6, fill: colors[j % colors.length]}, svg).textContent = n;
+    });
+}
+var name = decodeURIComponent(location.hash.slice(1));
+if (/^popdata_[0-9a-f]+\.js$/.test(name)) {
+    var script = document.createElement("script");
+    script.src = name;
+    document.body.appendChild(script);
+}
+</script>
+</body>
+</html>
+"""
+    with open(filename,"w") as f:
+        f.write(html)
+    popcharts.add(filename)
+    return filename
+
+
+def plotdataPopInfo(df,vals,info,outdir=popupdir):
     """
     Popup data ploter with information columns 
     Takes in the data desired to plot, 
     the  varaibles and the infomration about the location and sensor for the popup
     returned the popup
+    The chart is drawn from a small data file (see popupdata) when the popup is opened,
+    outdir is the folder the map html is saved in
     """    
     #def data beased on values 
-    figname=""
     df.index=pd.to_datetime(df.index)
     try:
-        #df=df.copy()
-        width=len(df.index)
-        if width <500: #if there not much data, still make is big enoguh
-            width=400
-        #if more values are wanted to be plotted, add fadding 
-        alpha=1 
-        if len(vals) >1:
-            alpha=0.8
-        
-        #define figure 
-        fig, ax = plt.subplots(figsize=(6,6))
-        if "GPS" in info["Site"]:  #if its a GPS file add the 1 min mean to the plot
-            mindf=df.resample("1T").mean()
-            for val in vals:
-                minval=val+"(1 min-mean)" 
-                ax.plot(mindf[val], label=minval,alpha=alpha) 
-            
-            ax.legend()
+        if "GPS" in info["Site"]:  #if its a GPS file chart the 1 min mean
+            chart=popupdata(df.resample("1min").mean(),vals,info["Site"]+" (1 min-mean)",outdir)
         else:       
-            ax = df.plot(ax=ax, legend=True, alpha=alpha)
-        ax.set_ylabel('Mass concentration (uu g/m^3)')
-        ax.set_xlabel('')
-        
-      #  ax.xaxis.set_major_locator(mdates.MinuteLocator(interval=60*3))   #to get a tick every 6 hours 
-        #ax.format_xdata = plt.DateFormatter('%H:%M')
-        ax.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))     #optional formatting 
-        ax.set_title(info["Site"])
-        ax.grid()
-        
-       #create a htlmfile for the plot
-        date=pd.to_datetime(df.index[0]).strftime("%Y%m%d")#get the date 
-        figname = 'popplot_'+info["Site"]+"_"+date+'.html'
-        #The location dic has to be added sepratly, as the HTML map will be created from pic inside the same output directory
-        mpld3.save_html(fig,"Mapoutput//"+figname)
+            chart=popupdata(df,vals,info["Site"],outdir)
      
     
         #Generate some more plot information based on data   
@@ -490,7 +992,7 @@ def plotdataPopInfo(df,vals,info):
             MINid=df[vals[0]].idxmin()
             MINid=MINid.strftime("%H:%M")
             MIN=str(round(MIN,2))+" ug/m^3 </br> at "+str(MINid)
-            print("Check min value ",MIN)
+            logger.debug('Check min value %s', MIN)
             mean=str(round(df[vals[0]].mean(),2))+" ug/m^3"
            # print(MAX,MIN,mean)
         except:
@@ -550,8 +1052,7 @@ def plotdataPopInfo(df,vals,info):
       
       <div class="row">
     	<div class="column">
-        <iframe src= '"""+figname+"""' name="sample" width="300" height="350">
-        </iframe>
+        """+popupframe(chart,300,350)+"""
     	</div>
         <br />
         <div class="column">
@@ -602,10 +1103,8 @@ def plotdataPopInfo(df,vals,info):
         popup = folium.Popup(pop,  max_width=800) 
         return popup
     except  Exception as e:
-                print("Error in GPS Data cirlce generation")
-                print('Error on line {}'.format(sys.exc_info()[-1].tb_lineno))
-                print(type(e))
-                print(e.args)
+                logger.error('Error in GPS Data cirlce generation')
+                logger.debug('Error details', exc_info=True)
                 pass
 
 
@@ -615,6 +1114,7 @@ def plotdataPopVega(data,vals):
     What then can be added to a marker
     
     '''
+    import vincent #needed to get plot in popup, only used here
     df=data[vals]
     
     df.fillna(value='null', inplace=True)  # Does not handle missing values.
@@ -633,11 +1133,13 @@ def plotdataPopVega(data,vals):
     popup = folium.Popup(max_width=line.width+75).add_child(vega)
     return popup
 
-def plotdataPop(data,vals):
+def plotdataPop(data,vals,outdir=popupdir):
     
     """
-    simple data popup, take in data and values, plots it as a mpld3 plot allowing for interaction, 
-    add it to an Iframe what then can be used in a folium map popup    
+    simple data popup, take in data and values, writes the data for a chart with popupdata
+    and puts the chart page in an iframe what then can be used in a folium map popup,
+    the chart is only drawn when the popup is opened
+    outdir: folder the map html is saved in
     
     returns a popup
     
@@ -647,46 +1149,18 @@ def plotdataPop(data,vals):
     """
     try:
         df=data[vals]
-      # print(df)
         width=300
         height=320
-        #If more than one varable add fadding 
-        alpha=1
-        if len(vals) >1:
-            alpha=0.8
-        #define figure    
-        fig, ax = plt.subplots(figsize=(4,4))
-        #plot data
-        for val in vals:
-            ax.plot(df[val], alpha=alpha,label=val)
-            
-        ax.legend()    
-        #Plot information
-        ax.set_ylabel('Mass concentration (ug/m^3)')
-        ax.set_xlabel('') #solving issue with x labes being cut in 1/2 
         #set tile based of time interval
-        
-        ax.set_title(df.index[0].strftime("%Y/%m/%d")+"-("+df.index[0].strftime("%H:%M")+" to "+df.index[len(df)-1].strftime("%H:%M"))
-        ax.grid() #grid 
-      
-        #setppop up in mld3
-        now=datetime.datetime.now()
-        date=df.index[0].strftime("%Y%m%d")#get the date 
-        #save=datetime.datetime.strptime(now,"%HH%MM%SS")
-        figname = 'popup_plot'+date+str(now.microsecond)+'.html'
-        mpld3.save_html(fig,'Mapoutput//'+figname)
-        time.sleep(0.1)
-        a=mpld3.fig_to_html(fig)
+        title=df.index[0].strftime("%Y/%m/%d")+"-("+df.index[0].strftime("%H:%M")+" to "+df.index[len(df)-1].strftime("%H:%M")+")"
+        chart=popupdata(df,vals,title,outdir)
         #put pop up in iframe format ready to be put into the popup
-        iframe = IFrame(a, width=(width), height=(height))
-        popup = folium.Popup(iframe,  max_width=600) 
+        popup = folium.Popup(folium.Html(popupframe(chart,width,height),script=True),  max_width=600) 
     
         return popup
     except  Exception as e:
-                    print("Error in GPS Data cirlce generation")
-                    print('Error on line {}'.format(sys.exc_info()[-1].tb_lineno))
-                    print(type(e))
-                    print(e.args)
+                    logger.error('Error in GPS Data cirlce generation')
+                    logger.debug('Error details', exc_info=True)
                     pass
     
     
@@ -701,7 +1175,7 @@ def generate_data(lat,lon,N):
         dec_lat=random.random()/100
         dec_lon=random.random()/100
         con=round((math.sin(10*x))**2*50,2)
-        print(con)
+        logger.debug('%s', con)
        
         data.append([lat+dec_lat,lon+dec_lon,con])
     return data
@@ -710,20 +1184,57 @@ def generate_data(lat,lon,N):
 
 
 
-def Staticsitedatetime(df,info,val,m):
+def geojsonpoints(times,lat,lon,fill_colors,radius=7,popups=None):
+    """
+    Columnar GeoJson builder for time stamped points, the features are made straight from
+    the arrays as GeoJson text, no dict for each row.
+    The style of each colour is encoded once and shared by all the features with that colour.
+    popups (optional) is a popup text for each point.
+    Returns a list of feature strings, use featurecollection to join them.
+    """
+    styles={}
+    for color in set(fill_colors):
+        style={'style': {'color' : color},
+               'icon': 'circle',
+               'iconstyle':{'fillColor': color,'fillOpacity': 0.8,'stroke': 'true','radius': radius}}
+        styles[color]=json.dumps(style,separators=(",",":"))[1:-1]
+    times=pd.Index(times).astype(str)
+    lon=np.round(np.asarray(lon,dtype=float),6)
+    lat=np.round(np.asarray(lat,dtype=float),6)
+    template='{"type":"Feature","geometry":{"type":"Point","coordinates":[%r,%r]},"properties":{"time":"%s",%s}}'
+    if popups is not None:
+        template='{"type":"Feature","geometry":{"type":"Point","coordinates":[%r,%r]},"properties":{"time":"%s",%s,"popup":%s}}'
+        return [template % (x,y,t,styles[c],json.dumps(p)) for x,y,t,c,p in zip(lon.tolist(),lat.tolist(),times,fill_colors,popups)]
+    return [template % (x,y,t,styles[c]) for x,y,t,c in zip(lon.tolist(),lat.tolist(),times,fill_colors)]
+
+
+def featurecollection(features):
+    """
+    Join feature strings (from geojsonpoints, or dicts) into a GeoJson FeatureCollection string
+    """
+    features=[f if isinstance(f,str) else json.dumps(f,separators=(",",":")) for f in features]
+    return '{"type":"FeatureCollection","features":['+",".join(features)+']}'
+
+
+def savegeojson(collection,filename):
+    """
+    Write a FeatureCollection string to its own file
+    """
+    with open(filename,"w") as f:
+        f.write(collection)
+
+
+@timed()
+def Staticsitedatetime(df,info,val,m,maxpoints=None,scale="default"):
     """
     Generate style data for GeoJson time stamp in GenStaticTimemap 
     Takes in a df and location, get the wanted value
     Functional for static and GPS data
+    maxpoints: if set GPS data are simplified to at most maxpoints features (see simplifytrack)
+    Returns the GeoJson features as strings (see geojsonpoints) and the data
     
     Created:2019/05/31
     """
-    features=[] #array to append Geojson features too
-    
-    print("info")
-    print(info)
-    print(df)
-
     #get locations from info
     #loc=info["Location:"][0]
     #sen=info["Sensors:"][0]
@@ -732,74 +1243,316 @@ def Staticsitedatetime(df,info,val,m):
     loc="GPS"
     sen="SDS"
 
-    print(loc)
-    if "GPS" not in loc: #check if its static of GPS data
-        Lat=info["Location:"][2]
-        lon=info["Location:"][3]
-                #print("siteinfo",Lat,lon)
-               # PMstyle=pd.DataFrame()  
-    #features=[]
-    
-    for index,row in df.iterrows():
-        #print(index,row[val])
-        pm=row[val] #get value
-        row["color"]=genfill_color(pm,100) #generate color
-        if "GPS" in loc: #if walk data get lat and lon
-            lon=row["lon"]
-            Lat=row["lat"]
-        #freate GeoJson feature    
-        feature = {
-                'type': 'Feature',
-                
-                'geometry': {
-                        'type':'Point', 
-                        'coordinates':[lon,Lat]
-                        },
-        'properties': {
-       # 'popup':location+" - "+sen+"<br>"+val+":"+str(round(pm,2)),
-        'time': str(index),
-        'style': {'color' : row['color']},
-        'icon': 'circle',
-        'iconstyle':{
-            'fillColor': row['color'],
-            'fillOpacity': 0.8,
-            'stroke': 'true',
-            'radius': 7
-                    }
-                     },
-            }
-         #append feature 
-        
-        features.append(feature)
-        features.append(plugins.Terminator().to_json(str(index)))
+    if "GPS" in loc and maxpoints and len(df)>maxpoints:
+        df=df.iloc[simplifytrack(df["lat"],df["lon"],df[val],maxpoints)]
+    if "GPS" in loc: #if walk data get lat and lon
+        Lat=df["lat"].values
+        lon=df["lon"].values
+    else: #static data, one location from the info
+        Lat=np.full(len(df),float(info["Location:"][2]))
+        lon=np.full(len(df),float(info["Location:"][3]))
+    fill_colors=genfill_colors(df[val],scale) #generate colors
+    features=geojsonpoints(datatimes(df),Lat,lon,fill_colors)
     return  features,df
 
 
+#map data kept apart from the map page
+def datahash(df,*settings):
+    """
+    Fingerprint of a DataFrame (index and values) and any settings used to make an output from it
+    """
+    h=hashlib.sha1()
+    h.update(pd.util.hash_pandas_object(df,index=True).values.tobytes())
+    h.update(repr(list(df.columns)).encode())
+    for setting in settings:
+        h.update(repr(setting).encode())
+    return h.hexdigest()
+
+
+def GenMapData(Datadic,val,outdir,titlename="Map",maxpoints=5000,scale="default",timeslider=False):
+    """
+    Map with the data kept apart from the html.
+    The base page (index.html) is only written once, it loads layers.json and then one
+    GeoJson file for each data set in Datadic, all in outdir.
+    A data file is only rewritten when its data or settings changed, so a refresh only
+    costs the data that changed.
+    timeslider: add a time slider to the page (only show the points up to the chosen time)
+    The page loads the data with fetch, so open it through a web server
+    (i.e. python -m http.server in outdir) rather than as a file.
+    Returns the list of files written.
+    """
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    manifestfile=os.path.join(outdir,"layers.json")
+    old={}
+    if os.path.exists(manifestfile):
+        with open(manifestfile) as f:
+            old={layer["file"]:layer["hash"] for layer in json.load(f)["layers"]}
+    sc=getscale(scale)
+    manifest={"title":titlename,"timeslider":timeslider,"layers":[],
+              "scale":{"colors":list(sc["colors"]),"values":[float(v) for v in sc["values"]]}}
+    written=[]
+    bounds=[]
+    for k, data in Datadic.items():
+        col=val if val in data.columns else "sds-"+val #account for SDS data format
+        df=data[["lat","lon",col]].apply(pd.to_numeric,errors="coerce").set_axis(datatimes(data)).dropna()
+        if maxpoints and len(df)>maxpoints:
+            df=df.iloc[simplifytrack(df["lat"],df["lon"],df[col],maxpoints)]
+        if len(df)==0:
+            continue
+        bounds.append([df["lat"].min(),df["lon"].min(),df["lat"].max(),df["lon"].max()])
+        key=datahash(df,col,maxpoints,manifest["scale"])
+        name=re.sub(r"[^A-Za-z0-9_.-]","_",k)+".json"
+        manifest["layers"].append({"name":k,"file":name,"hash":key})
+        if old.get(name)==key and os.path.exists(os.path.join(outdir,name)):
+            continue
+        popups=[col+": "+str(v) for v in np.round(df[col].values,2)]
+        features=geojsonpoints(df.index,df["lat"],df["lon"],genfill_colors(df[col],scale),popups=popups)
+        savegeojson(featurecollection(features),os.path.join(outdir,name))
+        written.append(name)
+    if bounds:
+        b=np.array(bounds)
+        manifest["bounds"]=[[b[:,0].min(),b[:,1].min()],[b[:,2].max(),b[:,3].max()]]
+    text=json.dumps(manifest)
+    oldtext=None
+    if os.path.exists(manifestfile):
+        with open(manifestfile) as f:
+            oldtext=f.read()
+    if text!=oldtext:
+        with open(manifestfile,"w") as f:
+            f.write(text)
+        written.append("layers.json")
+    if not os.path.exists(os.path.join(outdir,"index.html")):
+        GenMapPage(outdir)
+        written.append("index.html")
+    logger.info('Map data written %s', written)
+    return written
+
+
+def GenMapPage(outdir):
+    """
+    Base page for GenMapData, it gets everything (title, colour scale, layers) from layers.json
+    so it never has to be rewritten.
+    """
+    html="""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Map</title>
+<link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css"/>
+<script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"></script>
+<style>
+html, body, #map { height: 100%; margin: 0; }
+.legend, .slider { background: white; padding: 6px; font: 12px sans-serif; }
+.legend i { display: inline-block; width: 14px; height: 14px; margin-right: 4px; }
+</style>
+</head>
+<body>
+<div id="map"></div>
+<script>
+var map = L.map("map");
+L.tileLayer("https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png",
+    {attribution: "&copy; OpenStreetMap contributors"}).addTo(map);
+var control = L.control.layers(null, {}, {collapsed: true}).addTo(map);
+var points = [];
+fetch("layers.json", {cache: "no-cache"}).then(function (r) { return r.json(); }).then(function (manifest) {
+    document.title = manifest.title;
+    if (manifest.bounds) { map.fitBounds(manifest.bounds); }
+    var legend = L.control({position: "topright"});
+    legend.onAdd = function () {
+        var div = L.DomUtil.create("div", "legend");
+        var s = manifest.scale;
+        for (var i = 0; i < s.colors.length; i++) {
+            div.innerHTML += '<i style="background:' + s.colors[i] + '"></i>' +
+                s.values[i] + "-" + s.values[i + 1] + "<br>";
+        }
+        return div;
+    };
+    legend.addTo(map);
+    var loads = manifest.layers.map(function (layer) {
+        //the hash makes the browser reload a file only when it changed
+        return fetch(layer.file + "?v=" + layer.hash).then(function (r) { return r.json(); }).then(function (data) {
+            var group = L.geoJSON(data, {
+                pointToLayer: function (feature, latlng) {
+                    var style = feature.properties.iconstyle;
+                    style.color = feature.properties.style.color;
+                    var marker = L.circleMarker(latlng, style);
+                    marker.time = Date.parse(feature.properties.time.replace(" ", "T"));
+                    points.push(marker);
+                    return marker;
+                },
+                onEachFeature: function (feature, layer) {
+                    if (feature.properties.popup) { layer.bindPopup(feature.properties.time + "<br>" + feature.properties.popup); }
+                }
+            }).addTo(map);
+            control.addOverlay(group, layer.name);
+        });
+    });
+    if (manifest.timeslider) {
+        Promise.all(loads).then(function () {
+            var times = points.map(function (p) { return p.time; });
+            var start = Math.min.apply(null, times), end = Math.max.apply(null, times);
+            var slider = L.control({position: "bottomleft"});
+            slider.onAdd = function () {
+                var div = L.DomUtil.create("div", "slider");
+                div.innerHTML = '<input type="range" min="' + start + '" max="' + end + '" value="' + end +
+                    '" step="60000" style="width:300px"><br><span></span>';
+                L.DomEvent.disableClickPropagation(div);
+                var input = div.querySelector("input"), label = div.querySelector("span");
+                input.oninput = function () {
+                    var t = Number(input.value);
+                    label.innerHTML = new Date(t).toISOString().replace("T", " ").slice(0, 16);
+                    points.forEach(function (p) {
+                        var show = p.time <= t;
+                        p.setStyle({opacity: show ? 1 : 0, fillOpacity: show ? 0.8 : 0});
+                    });
+                };
+                return div;
+            };
+            slider.addTo(map);
+        });
+    }
+});
+</script>
+</body>
+</html>
+"""
+    with open(os.path.join(outdir,"index.html"),"w") as f:
+        f.write(html)
+
+
+def datatimes(df):
+    """
+    Reading times of a data set, its index if that is a time index, or else its "time" column
+    (i.e. the data sets made by splitsensors)
+    """
+    if isinstance(df.index,pd.DatetimeIndex):
+        return df.index
+    if "time" in df.columns:
+        return pd.DatetimeIndex(pd.to_datetime(df["time"]))
+    raise ValueError("No reading times, the data needs a time index or a time column")
+
+
+def avefreq(ave):
+    """
+    pandas frequency of an averaging period, "RAW" is 1 minute and the old "T" minute alias
+    (i.e. "15T"), which pandas no longer takes, is changed to "min"
+    """
+    if ave.upper()=="RAW":
+        return "1min"
+    return re.sub(r"^(\d*)T$",r"\1min",ave)
+
+
+def aveminutes(ave):
+    """
+    Length of an averaging period in whole minutes (at least 1)
+    """
+    freq=avefreq(ave)
+    if not freq[0].isdigit():
+        freq="1"+freq
+    return max(1,int(pd.Timedelta(freq).total_seconds()//60))
+
+
+#animation frames for TimestampedGeoJson
+framesteps=[1,2,5,10,15,30,60,120,180,360,720,1440] #frame periods (min) to pick from
+
+def frameperiod(start,end,maxframes=300):
+    """
+    Frame period (min) for a time span, the smallest of framesteps giving at most maxframes frames
+    """
+    span=(pd.Timestamp(end)-pd.Timestamp(start)).total_seconds()/60
+    for step in framesteps:
+        if span/step<=maxframes:
+            return step
+    return int(np.ceil(span/maxframes))
+
+
+def genframes(Datadic,val,period=None,maxframes=300,scale="default",radius=5):
+    """
+    Animation frames for TimestampedGeoJson, the readings are binned into frames of period
+    minutes (picked from the data span with frameperiod if None) and each frame has one
+    MultiPoint feature for each data set and colour, instead of one feature per reading
+    (with the frame time repeated for each point in "times").
+    Returns the feature strings and the period used.
+    """
+    data={k:df for k,df in Datadic.items() if len(df)}
+    if not data:
+        return [],period or 1
+    times={k:datatimes(df) for k,df in data.items()}
+    start=min(t.min() for t in times.values())
+    end=max(t.max() for t in times.values())
+    if period is None:
+        period=frameperiod(start,end,maxframes)
+    start=pd.Timestamp(start).floor(str(period)+"min")
+    step=period*60*10**9
+    features=[]
+    for k,df in data.items():
+        col=val if val in df.columns else "sds-"+val #account for SDS data format
+        frame=(np.asarray(times[k].values,dtype="datetime64[ns]")-np.datetime64(start,"ns")).astype(np.int64)//step
+        fill_colors=genfill_colors(df[col],scale)
+        palette,colorindex=np.unique(fill_colors.astype(str),return_inverse=True)
+        colorindex=colorindex.ravel()
+        styles=[json.dumps({'style': {'color' : c},'icon': 'circle','popup': k,
+                            'iconstyle':{'fillColor': c,'fillOpacity': 0.8,'stroke': 'true','radius': radius}},
+                           separators=(",",":"))[1:-1] for c in palette]
+        #sort by frame then colour and write each run as one feature
+        key=frame*len(palette)+colorindex
+        order=np.argsort(key,kind="stable")
+        key=key[order]
+        lon=np.round(df["lon"].values[order].astype(float),5)
+        lat=np.round(df["lat"].values[order].astype(float),5)
+        coords=np.column_stack((lon,lat)).tolist()
+        starts=np.flatnonzero(np.concatenate(([True],key[1:]!=key[:-1])))
+        stops=np.append(starts[1:],len(key))
+        for a,b in zip(starts,stops):
+            f,c=divmod(int(key[a]),len(palette))
+            #TimestampedGeoJson only draws the points of a MultiPoint that have a time in "times"
+            time=json.dumps([str(start+pd.Timedelta(minutes=f*period))]*int(b-a))
+            features.append('{"type":"Feature","geometry":{"type":"MultiPoint","coordinates":%s},"properties":{"times":%s,%s}}'
+                            % (json.dumps(coords[a:b],separators=(",",":")),time,styles[c]))
+    return features,period
+
+
 #generate standard map
 
-def GenStaticTimemap(Datadic,val,ave,titlename,infos): 
+@timed()
+def GenStaticTimemap(Datadic,val,ave,titlename,infos,grid=None,shape="square",maxpoints=5000,scale="default",datafile=None,datadir=None,frames=True,period=None,maxframes=300,cache=True): 
     """
     Generate a static time series make for Date in a Datadirectory, the location come from the Datadic keys
     needed functions Staticsitedatetime, colormap
     Features:basics popups
+    grid: cell size in m, if given the data are aggregated into square or "hex" cells for each
+    ave time interval (see gridcells) and the cells are plotted instead of every point
+    maxpoints: most points plotted for each data set (also with frames), long tracks are simplified (None for all)
+    scale: colour scale name used for the points and the colour bar (see colorscales)
+    datafile: if given the GeoJson FeatureCollection is also written to this file
+    datadir: if given the map is made with GenMapData in this folder instead, the page is only
+    made once and only the data files that changed are rewritten
+    frames: bin the readings into animation frames (see genframes) of period minutes,
+    picked from the data span so there are at most maxframes frames if period is None
+    cache: skip making the map if it was already made from the same data, settings and code (see AQCache)
     
     
     Created:08/06/2019
     #updated for RPI3 use
     """
-
-    print("Datadic")
-    print(Datadic)
-    print("")
+    if datadir:
+        return GenMapData(Datadic,val,datadir,os.path.basename(titlename),maxpoints,scale,timeslider=True)
+    if cache:
+        key=fingerprint(Datadic,val,ave,grid,shape,maxpoints,scale,datafile,frames,period,maxframes,codeversion(__file__,getscale))
+        if isfresh(titlename+".html",key,[titlename+".html"]+([datafile] if datafile else [])):
+            logger.info('Map up to date %s', titlename)
+            return
+
+    logger.debug('Datadic %s', Datadic)
     #Set initital Lat / Lon to center map 
     for k, data in Datadic.items():
-      print("k")
-      print(k)
+      logger.debug('k %s', k)
       Lat=data["lat"].iloc[0]
       Lon=data["lon"].iloc[0]
 
-    print("Lat = ",Lat)
-    print("Lon = ",Lon)
+    logger.debug('Lat = %s', Lat)
+    logger.debug('Lon = %s', Lon)
 
     #generate base map
 
@@ -812,41 +1565,43 @@ def GenStaticTimemap(Datadic,val,ave,titlename,infos):
         #index=[0,5,10,15,20,25,30,40,50]
         #index=[0,0.5,1,1.5,2,2.5,3,3.5,4]
         #colorbar_index=[0,1,2,3,4,5,6,7,8]
-        colormap(m,colorbar_values,"Mass concentration ug/m^3")
+        colormap(m,colorbar_values,"Mass concentration ug/m^3",scale)
         styledict=[] #Stlyed dict for the time stamped features to be added to map
     
     #loop through data dic, getting the location and putting the data as geojseon data under style
+    frameitems={} #data for the animation frames
     for k, item in Datadic.items():
-        print("k = ",k)
-        print("item = ",item)
-        print("*****")
-        print("*****")
-        print("*****")
-        print("*****")
+        logger.debug('k = %s', k)
+        logger.debug('item = %s', item)
     #    print(item.head(4),loc)
-        if val.upper()=="PM2.5" or val.upper()=="PM10" and "SDS" in k.upper():
-            val="sds-"+val
-            print("val = ",val)
+        col=val if val in item.columns else "sds-"+val #account for SDS data format
+        logger.debug('col = %s', col)
         item=item.dropna()
-        style,df=Staticsitedatetime(item,infos[k],val,m) #Add the time stamed geoJson
+        if grid:
+            cells=gridcells(item["lat"],item["lon"],item[col],grid,shape,keys=datatimes(item).floor(avefreq(ave)))
+            style=gridfeatures(cells,grid,shape,scale=scale)
+        elif frames:
+            if maxpoints and len(item)>maxpoints: #simplify long tracks as Staticsitedatetime does
+                item=item.iloc[simplifytrack(item["lat"],item["lon"],item[col],maxpoints)]
+            frameitems[k]=item
+            style=[]
+        else:
+            style,df=Staticsitedatetime(item,infos[k],col,m,maxpoints,scale) #Add the time stamed geoJson
         styledict=styledict+style 
     #Read the styledict, puting the time onto the map  
-    if ave.upper()=="RAW":
-        interval="1T"
+    if frames and not grid:
+        style,period=genframes(frameitems,val,period,maxframes,scale)
+        styledict=styledict+style
+        interval=str(period)
     else:
-        i=ave.find("T")
-        interval=ave[0:i]
-        print(interval)
-
-    print("interval = ",interval)
-    print("*******")
-    interval="1"
-
-    TimestampedGeoJson(
-                {
-                        'type': 'FeatureCollection',
-                        'features': styledict,
-                        },
+        interval=str(aveminutes(ave))
+
+    logger.debug('interval = %s', interval)
+
+    collection=featurecollection(styledict)
+    if datafile:
+        savegeojson(collection,datafile)
+    TimestampedGeoJson(collection,
           period='PT'+interval+'M'
         , add_last_point=True
         , auto_play=False
@@ -856,50 +1611,70 @@ def GenStaticTimemap(Datadic,val,ave,titlename,infos):
         , time_slider_drag_update=True).add_to(m)
        
     m.save(titlename+".html")
+    written(titlename+".html",datafile)
+    if cache:
+        stamp(titlename+".html",key)
    
 
 
-def genmap(Datadic,val,titlename,infos):
+@timed()
+def genmap(Datadic,val,titlename,infos,grid=None,shape="square",maxpoints=5000,scale="default",layer=True,datadir=None,cache=True):
     """
     Daniel Jarvis 
     Vertion generate a MAP based on one date, and returned the data into a dictionary 
    
     retrun a dictionary full of data, and a html map name
+    grid: cell size in m, if given the walks are drawn as square or "hex" cells of
+    aggregated data (GenPMGrid) instead of one circle per reading
+    maxpoints: most circles drawn for each walk, long walks are simplified (None for all)
+    scale: colour scale name used for the circles and the colour bar (see colorscales)
+    layer: draw each walk as one canvas layer (PMPointLayer), False for one folium.Circle per reading
+    datadir: if given the map is made with GenMapData in this folder instead, the page is only
+    made once and only the data files that changed are rewritten
+    cache: skip making the map if it was already made from the same data, settings and code (see AQCache)
    
     last edit: 29/04/2019
    
     """
+    if datadir:
+        return GenMapData(Datadic,val,datadir,os.path.basename(titlename),maxpoints,scale)
+    if cache:
+        key=fingerprint(Datadic,val,grid,shape,maxpoints,scale,layer,codeversion(__file__,getscale))
+        if isfresh(titlename+".html",key):
+            logger.info('Map up to date %s', titlename)
+            return
     #start
-    print("Starting map generation, Values:"+str(val)+ "title:"+titlename)
+    logger.info('Starting map generation, Values: %s title: %s', val, titlename)
     #plase holder to make code run
        
     #Lat=[]
     #Lon=[]
    
-    Lat=Datadic["lat"].iloc[0]
-    Lon=Datadic["lon"].iloc[0]
+    for k, data in Datadic.items():
+        Lat=data["lat"].dropna().iloc[0]
+        Lon=data["lon"].dropna().iloc[0]
     #for k , info in infos.items():
     #        locs=infos[k]['Location:']
     #        Lat=float(locs[2])
     #        Lon=float(locs[3])
-    print(Lat,Lon)
+    logger.debug('%s %s', Lat, Lon)
     #CenLatlon=[Lat,Lon]
     
     #create base map
-    print("Generating Base map, center :",[Lat,Lon])
+    logger.info('Generating Base map, center : %s', [Lat,Lon])
     m=folium.Map([Lat,Lon],zoom_start=15,tiles='OpenStreetMap')
       #generate a color bar based on input value 
     if "PM" in val.upper():
         #index=[0,5,10,15,20,25,30,40,50]
         #colorbar_index=[0,1,2,3,4,5,6,7,8]
-        colormap(m,colorbar_values,"Mass concentration ug/m^3")
+        colormap(m,colorbar_values,"Mass concentration ug/m^3",scale)
     elif val=="ParticleCount":
         #colorbar_index=[0,500,1000,1500,2000,2500,3000,4000,5000]
-        colormap(m,colorbar_values,"Mass concentration ug/m^3")
+        colormap(m,colorbar_values,"Mass concentration ug/m^3",scale)
      
    
   
-    print("Base map generated")
+    logger.info('Base map generated')
    
         
    
@@ -908,7 +1683,7 @@ def genmap(Datadic,val,titlename,infos):
     #Generate Walk GPS data  
      #---------------------
     for k, data in Datadic.items():
-        print("Generating GPS walk data for ",k)
+        logger.info('Generating GPS walk data for %s', k)
         #dont plot GPS data with erros 
         mask = ~np.isnan(data["lat"]) & ~np.isnan(data["lon"])
         df=data[mask]
@@ -917,17 +1692,12 @@ def genmap(Datadic,val,titlename,infos):
         try:
             #generate walkdata and still data, i.e if you sat for 20mins outside, or chatted for 5 mins
             #print(info,df.head(4))
-            print("********************")
-            print("********************")
-            print("********************")
-            print("********************")
-            print("info","df.head(1)")
-            print(info,df.head(1))
+            logger.debug('%s %s', info, df.head(1))
             #get walk data and still data 
             #print(walks)
-            print(df.head(1))
+            logger.debug('%s', df.head(1))
             #print(df.head(4))
-            print("Plotting GPS walk data")
+            logger.info('Plotting GPS walk data')
             #create group for GPS data
             walkg = folium.FeatureGroup(name=k)
             m.add_child(walkg)
@@ -935,17 +1705,19 @@ def genmap(Datadic,val,titlename,infos):
     
             
             #get start and end times
-            start=df.index[0]
-            end=df.index[len(df)-1]
+            times=datatimes(df)
+            start=times[0]
+            end=times[len(df)-1]
             walkinfo={}
             #get location name
             #Sindex=W.index("Data\\")+5
             #Endindex=W.index("_GPS")+4
             locationname="Test" #W[Sindex:Endindex]
-            print("Location name", locationname)
-            walkinfo["Site"]=k.split(":")[0]
+            logger.debug('Location name %s', locationname)
+            site,_,sensor=k.rpartition(":") #keys are "site:sensor", or just the sensor (i.e. "SDS01")
+            walkinfo["Site"]=site or k
            # getting sensors name 
-            walkinfo["Sensor"]=k.split(":")[1]
+            walkinfo["Sensor"]=sensor
             walkinfo["start date"]=str(pd.to_datetime(start).strftime("%H:%M"))
             walkinfo["end date"]=str(pd.to_datetime(end).strftime("%H:%M"))
             walkinfo["Link"]=""
@@ -954,22 +1726,20 @@ def genmap(Datadic,val,titlename,infos):
            # DataMarkerInfo(df,val,info["Location:"][2],info["Location:"][3],walkg,walkinfo)
             #print("Check",walkdf["pm2"]) 
             #Plot walk data   
-            if "SDS" in k.upper(): #account for SDS data format
-                val="sds-"+val
+            col=val if val in df.columns else "sds-"+val #account for SDS data format
                 
-            #Create GPS Walk cirles 
-        
-            GenPMCircles(df,val,walkg,"green")
+            #Create GPS Walk cirles or grid cells
+            if grid:
+                GenPMGrid(df,col,walkg,grid,shape,scale=scale)
+            else:
+                GenPMCircles(df,col,walkg,"green",maxpoints,scale,layer)
             
             
             #start plotting data on map
-            print("-------------------------Ploted GPS walk data-----------------------------------")
+            logger.info('Ploted GPS walk data')
         except Exception as e:
-            print("-------------------------Error------------------------------------")
-            print("GPS plot error")
-            print('Error on line {}'.format(sys.exc_info()[-1].tb_lineno))
-            print(type(e))
-            print(e.args)
+            logger.error('GPS plot error')
+            logger.debug('Error details', exc_info=True)
             pass
 
     
@@ -977,4 +1747,7 @@ def genmap(Datadic,val,titlename,infos):
     folium.LayerControl(collapsed=True).add_to(m)
     #save map
     m.save(titlename+".html")
-    print("Map Created")
+    written(titlename+".html")
+    if cache:
+        stamp(titlename+".html",key)
+    logger.info('Map Created')
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 2026
+
+Pre-rendered map tiles for multi-day and multi-device datasets.
+The PM readings are aggregated into a z/x/y pyramid of small JSON tiles
+(coarser cells at lower zoom) and written to a directory with a viewer page,
+so the browser only loads the tiles in view.
+"""
+
+import os
+import json
+import numpy as np
+import pandas as pd
+from AQColours import getscale
+
+
+def lonlattopixel(lat,lon,zoom,tilesize=256):
+    """
+    Web mercator (the OpenStreetMap tiles) global pixel x, y of lat / lon at a zoom level
+    """
+    n=tilesize*2**zoom
+    lat=np.clip(np.asarray(lat,dtype=float),-85.0511,85.0511)
+    x=(np.asarray(lon,dtype=float)+180)/360*n
+    siny=np.sin(np.radians(lat))
+    y=(0.5-np.log((1+siny)/(1-siny))/(4*np.pi))*n
+    return x,y
+
+
+def tilecells(lat,lon,values,zoom,cellpx=16,tilesize=256):
+    """
+    Aggregate the readings into square cells of cellpx screen pixels at a zoom level.
+    Returns the cell x, y numbers and the mean, max and count of each cell.
+    """
+    x,y=lonlattopixel(lat,lon,zoom,tilesize)
+    cx=np.floor(x/cellpx).astype(np.int64)
+    cy=np.floor(y/cellpx).astype(np.int64)
+    ncells=(tilesize*2**zoom)//cellpx
+    uid,groups=np.unique(cx*ncells+cy,return_inverse=True)
+    groups=groups.ravel()
+    count=np.bincount(groups)
+    mean=np.bincount(groups,weights=values)/count
+    vmax=np.full(len(uid),-np.inf)
+    np.maximum.at(vmax,groups,values)
+    return uid//ncells,uid%ncells,mean,vmax,count
+
+
+def gentiles(lat,lon,values,outdir,minzoom=10,maxzoom=17,cellpx=16,tilesize=256,scale="default",title="PM tiles"):
+    """
+    Write a z/x/y pyramid of JSON tiles for the readings into outdir, plus tiles.json
+    (the list of tiles that have data) and index.html (the viewer).
+    Each tile holds its cells as [x, y, mean, max, count] with x, y the cell number in the tile,
+    the cells are cellpx pixels at every zoom so lower zooms are coarser.
+    The viewer colours the cells with the same colour scale as colormap.
+    The viewer loads the tiles with fetch, so open it through a web server
+    (i.e. python -m http.server in outdir) rather than as a file.
+    Returns the number of tiles written.
+    """
+    lat=np.asarray(lat,dtype=float)
+    lon=np.asarray(lon,dtype=float)
+    values=np.asarray(values,dtype=float)
+    mask=~np.isnan(lat) & ~np.isnan(lon) & ~np.isnan(values)
+    lat,lon,values=lat[mask],lon[mask],values[mask]
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    per=tilesize//cellpx #cells along a tile
+    manifest={"minzoom":minzoom,"maxzoom":maxzoom,"cellpx":cellpx,"tilesize":tilesize,"tiles":{}}
+    ntiles=0
+    for zoom in range(minzoom,maxzoom+1):
+        cx,cy,mean,vmax,count=tilecells(lat,lon,values,zoom,cellpx,tilesize)
+        tx,ty=cx//per,cy//per
+        #sort the cells by tile and write each run of cells as one tile
+        order=np.lexsort((ty,tx))
+        tx,ty,cx,cy=tx[order],ty[order],cx[order],cy[order]
+        mean,vmax,count=mean[order],vmax[order],count[order]
+        starts=np.flatnonzero(np.concatenate(([True],(tx[1:]!=tx[:-1])|(ty[1:]!=ty[:-1]))))
+        stops=np.append(starts[1:],len(tx))
+        names=[]
+        for a,b in zip(starts,stops):
+            folder=os.path.join(outdir,str(zoom),str(tx[a]))
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            cells=np.column_stack((cx[a:b]%per,cy[a:b]%per,np.round(mean[a:b],2),np.round(vmax[a:b],2),count[a:b]))
+            with open(os.path.join(folder,str(ty[a])+".json"),"w") as f:
+                json.dump({"cells":cells.tolist()},f,separators=(",",":"))
+            names.append(str(tx[a])+"/"+str(ty[a]))
+        manifest["tiles"][str(zoom)]=names
+        ntiles=ntiles+len(names)
+    if len(lat):
+        manifest["bounds"]=[[lat.min(),lon.min()],[lat.max(),lon.max()]]
+    with open(os.path.join(outdir,"tiles.json"),"w") as f:
+        json.dump(manifest,f,separators=(",",":"))
+    genviewer(outdir,scale,title)
+    return ntiles
+
+
+def gentilesdic(Datadic,val,outdir,**kwargs):
+    """
+    gentiles for all the data sets (days / devices) in a data dictionary together
+    """
+    lat=np.concatenate([data["lat"].values for data in Datadic.values()])
+    lon=np.concatenate([data["lon"].values for data in Datadic.values()])
+    values=np.concatenate([pd.to_numeric(data[val],errors="coerce").values for data in Datadic.values()])
+    return gentiles(lat,lon,values,outdir,**kwargs)
+
+
+def genviewer(outdir,scale="default",title="PM tiles",stat=2):
+    """
+    Write the index.html viewer for the tiles, stat is the cell value used for the colour
+    (2 = mean, 3 = max)
+    """
+    sc=getscale(scale)
+    colorscale={"colors":list(sc["colors"]),"values":[float(v) for v in sc["values"]],
+                "under":sc["under"],"over":sc["over"]}
+    html="""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>"""+title+"""</title>
+<link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css"/>
+<script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"></script>
+<style>
+html, body, #map { height: 100%; margin: 0; }
+.legend { background: white; padding: 6px; font: 12px sans-serif; }
+.legend i { display: inline-block; width: 14px; height: 14px; margin-right: 4px; }
+</style>
+</head>
+<body>
+<div id="map"></div>
+<script>
+var scale = """+json.dumps(colorscale)+""";
+var stat = """+str(stat)+""";
+function color(v) {
+    if (v < scale.values[0]) { return scale.under; }
+    for (var i = 0; i < scale.colors.length; i++) {
+        if (v < scale.values[i + 1]) { return scale.colors[i]; }
+    }
+    return scale.over;
+}
+fetch("tiles.json").then(function (r) { return r.json(); }).then(function (manifest) {
+    var have = {};
+    for (var z in manifest.tiles) {
+        manifest.tiles[z].forEach(function (t) { have[z + "/" + t] = true; });
+    }
+    var map = L.map("map");
+    L.tileLayer("https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png",
+        {attribution: "&copy; OpenStreetMap contributors"}).addTo(map);
+    var PMTiles = L.GridLayer.extend({
+        createTile: function (coords, done) {
+            var tile = document.createElement("canvas");
+            var size = this.getTileSize();
+            tile.width = size.x;
+            tile.height = size.y;
+            var name = coords.z + "/" + coords.x + "/" + coords.y;
+            if (!have[name]) { setTimeout(function () { done(null, tile); }, 0); return tile; }
+            fetch(name + ".json").then(function (r) { return r.json(); }).then(function (data) {
+                var ctx = tile.getContext("2d");
+                var px = size.x / (manifest.tilesize / manifest.cellpx);
+                data.cells.forEach(function (c) {
+                    ctx.fillStyle = color(c[stat]);
+                    ctx.globalAlpha = 0.7;
+                    ctx.fillRect(c[0] * px, c[1] * px, px, px);
+                });
+                done(null, tile);
+            });
+            return tile;
+        }
+    });
+    new PMTiles({minZoom: manifest.minzoom, maxNativeZoom: manifest.maxzoom, maxZoom: 19}).addTo(map);
+    if (manifest.bounds) { map.fitBounds(manifest.bounds); } else { map.setView([0, 0], 2); }
+    var legend = L.control({position: "bottomright"});
+    legend.onAdd = function () {
+        var div = L.DomUtil.create("div", "legend");
+        for (var i = 0; i < scale.colors.length; i++) {
+            div.innerHTML += '<i style="background:' + scale.colors[i] + '"></i>' +
+                scale.values[i] + "-" + scale.values[i + 1] + "<br>";
+        }
+        return div;
+    };
+    legend.addTo(map);
+});
+</script>
+</body>
+</html>
+"""
+    with open(os.path.join(outdir,"index.html"),"w") as f:
+        f.write(html)
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 2026
+
+Run timing for the data pipeline.
+Each stage (reading, QC, resampling, maps, plots, dashboards) is timed and counted with
+stage (a with block) or timed (a function decorator), along with the rows it processed and
+the bytes it wrote (see written), and report gives the totals as a JSON run report.
+One stage can also be profiled with cProfile (time per function) or tracemalloc (memory per line),
+see setprofile.
+Only uses the standard library so it is quick to import.
+"""
+
+import os
+import sys
+import io
+import json
+import time
+import platform
+import functools
+import contextlib
+import cProfile
+import pstats
+import tracemalloc
+from datetime import datetime
+
+stages={} #totals of each stage, name -> calls, seconds, rows and bytes
+running=[] #names of the stages running, innermost last
+profilestage=None #name of the stage to profile, None for none
+profiler="cprofile" #"cprofile" or "tracemalloc"
+profiled={} #profile of profilestage, see startprofile
+started=time.time()
+toplines=25 #functions / lines kept in the profile of the report
+
+
+def reset():
+    """
+    Clear the totals, i.e. between runs in the same process
+    """
+    global started
+    stages.clear()
+    del running[:]
+    profiled.clear()
+    started=time.time()
+
+
+def setprofile(name,kind="cprofile"):
+    """
+    Profile the stage name (None for none) with kind "cprofile" or "tracemalloc".
+    Stages run in other processes (i.e. the plot processes) are not profiled
+    """
+    global profilestage,profiler
+    if kind not in ("cprofile","tracemalloc"):
+        raise ValueError("Unknown profiler "+str(kind)+", use cprofile or tracemalloc")
+    profilestage=name
+    profiler=kind
+
+
+def nrows(item):
+    """
+    Number of rows in a data frame / series / array, or in all of them in a dictionary,
+    list or tuple (i.e. Datadic), 0 for anything else
+    """
+    if isinstance(item,dict):
+        return sum(nrows(i) for i in item.values())
+    if isinstance(item,(list,tuple)):
+        return sum(nrows(i) for i in item)
+    if hasattr(item,"shape") and hasattr(item,"__len__"):
+        return len(item)
+    return 0
+
+
+def record(name):
+    """
+    The totals of stage name
+    """
+    return stages.setdefault(name,{"calls":0,"seconds":0.0,"rows":0,"bytes":0})
+
+
+def merge(totals):
+    """
+    Add stage totals made in another process (i.e. returned by the plot processes) to the run's
+    """
+    for name,total in totals.items():
+        mine=record(name)
+        for key in mine:
+            mine[key]+=total.get(key,0)
+
+
+def written(*files):
+    """
+    Add the size of files (those that exist) to the bytes written by the innermost running stage
+    """
+    if not running:
+        return
+    size=sum(os.path.getsize(f) for f in files if f and os.path.isfile(f))
+    record(running[-1])["bytes"]+=size
+
+
+def startprofile(name):
+    """
+    Start profiling if name is the stage to profile, returns what stopprofile needs (None if not)
+    """
+    if name!=profilestage or name in running:
+        return None
+    if profiler=="tracemalloc":
+        tracing=tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        return tracemalloc.take_snapshot(),tracing
+    if "cprofile" not in profiled:
+        profiled["cprofile"]=cProfile.Profile()
+    profiled["cprofile"].enable()
+    return profiled["cprofile"]
+
+
+def stopprofile(start):
+    """
+    Stop profiling the stage started with startprofile. For tracemalloc the highest peak is kept,
+    with the lines holding the most memory allocated in the call with that peak
+    """
+    if start is None:
+        return
+    if isinstance(start,cProfile.Profile):
+        start.disable()
+        return
+    snapshot,tracing=start
+    current,peak=tracemalloc.get_traced_memory()
+    if peak>=profiled.get("tracemalloc",{}).get("peak",0):
+        stats=tracemalloc.take_snapshot().compare_to(snapshot,"lineno")[:toplines]
+        profiled["tracemalloc"]={"peak":peak,"top":[
+            {"line":str(s.traceback[0]),"bytes":s.size_diff,"blocks":s.count_diff} for s in stats]}
+    if not tracing:
+        tracemalloc.stop()
+
+
+@contextlib.contextmanager
+def stage(name,rows=0):
+    """
+    Time a stage of the run as a with block, adding rows to its rows processed.
+    Yields the totals of the stage so rows found inside the block can be added
+    (i.e. total["rows"]+=len(data)). A stage inside itself is only counted once.
+    """
+    total=record(name)
+    if name in running:
+        total["rows"]+=rows
+        yield total
+        return
+    profile=startprofile(name)
+    running.append(name)
+    start=time.perf_counter()
+    try:
+        yield total
+    finally:
+        total["seconds"]+=time.perf_counter()-start
+        total["calls"]+=1
+        total["rows"]+=rows
+        running.pop()
+        stopprofile(profile)
+
+
+def timed(name=None,rows=0):
+    """
+    Decorator timing every call of a function as a stage (named as the function if not given).
+    rows: position of the argument whose rows are counted (see nrows),
+    or "result" to count the rows of what the function returns
+    """
+    def decorator(func):
+        stagename=name or func.__name__
+        @functools.wraps(func)
+        def wrapper(*args,**kwargs):
+            counted=nrows(args[rows]) if isinstance(rows,int) and len(args)>rows else 0
+            with stage(stagename,counted) as total:
+                result=func(*args,**kwargs)
+                if rows=="result":
+                    total["rows"]+=nrows(result)
+            return result
+        return wrapper
+    return decorator
+
+
+def cprofiletop(profile):
+    """
+    The functions taking the most time (cumulative) in a cProfile profile
+    """
+    stats=pstats.Stats(profile,stream=io.StringIO())
+    top=[]
+    for func in stats.sort_stats("cumulative").fcn_list[:toplines]:
+        calls,primitive,tottime,cumtime,callers=stats.stats[func]
+        top.append({"function":"{}:{}({})".format(*func),"calls":calls,
+                    "seconds":round(tottime,6),"cumulative":round(cumtime,6)})
+    return top
+
+
+def report(filename=None,**extra):
+    """
+    The run report: when and how the run was made, the total time and the
+    calls, seconds, rows and bytes written of each stage (in the order first run), and the
+    profile of the profiled stage, plus any extra entries. Stages run inside other stages
+    (i.e. Staticsitedatetime in GenStaticTimemap) are part of their time too.
+    Written to filename as JSON if given, with the full cProfile profile in filename.prof
+    (for pstats / snakeviz). Returns the report (dictionary)
+    """
+    out={"started":datetime.fromtimestamp(started).isoformat(timespec="seconds"),
+         "seconds":round(time.time()-started,3),
+         "python":platform.python_version(),
+         "argv":sys.argv,
+         "stages":{}}
+    out.update(extra)
+    for name,total in stages.items():
+        out["stages"][name]=dict(total,seconds=round(total["seconds"],6))
+    if profilestage:
+        out["profile"]={"stage":profilestage,"profiler":profiler}
+        if "cprofile" in profiled:
+            out["profile"]["top"]=cprofiletop(profiled["cprofile"])
+        elif "tracemalloc" in profiled:
+            out["profile"].update(profiled["tracemalloc"])
+    if filename:
+        folder=os.path.dirname(filename)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        with open(filename,"w") as f:
+            json.dump(out,f,indent=1)
+        if "cprofile" in profiled:
+            profiled["cprofile"].dump_stats(filename+".prof")
+    return out
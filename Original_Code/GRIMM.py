@@ -6,13 +6,18 @@ Created on Fri Apr 12 09:52:20 2019
 GRIMM Data import 
 """
 
+import errno
 import glob
+import logging
 from datetime import datetime as dt
+from time import sleep, monotonic
 import pandas as pd
 import matplotlib.pylab as plt
 import math as mp
 import numpy as np
 
+logger=logging.getLogger(__name__)
+
 def pandaGRIMM(Folder,yearmonth):
     '''
     GRIMM raw data converter. Takes raw GRIMM files and added them to a Panda array format
@@ -26,105 +31,216 @@ def pandaGRIMM(Folder,yearmonth):
     for file in glob.glob(Folder+'***.GRIMM'):
         if yearmonth in file:
             Gfiles.append(file)
-    print(Gfiles)
+    logger.debug('%s', Gfiles)
     Gfiles=sorted(Gfiles) #does them in a random order , so need to be sorted
     #Create and PD dataframe ready  
     GBin = ["0.3um","0.4um","0.5um","0.65um","0.8um","1um","1.6um","2um","3um","4um","5um","7.5um","10um","15um","20um"]
     
    # GBin = ["b0","b1","b2","b3","b4","b5","b6","b7","b8","b9","b10","b11","b12","b13","b14"]
-    Gdata=pd.DataFrame(columns=["time"]+GBin)
-    i=0 #set and DataFrame index 
+    times=[] #record times
+    counts=[] #record bin counts
     #cylce through all GRIMM files  
     #run time marker
     L=len(Gfiles)
     M=0
-    print("-----"+str(L)+"------")
+    logger.debug('%s files', L)
     for Gfile in Gfiles:
         M=M+1
-        print(M)
+        logger.debug('File %s of %s', M, L)
         if M==L/2:
-            print("半分")
+            logger.debug('半分')
         elif M==1/4*L:
-            print("1/4分")
+            logger.debug('1/4分')
         elif M==3/4*L:
-            print("3/4分")
+            logger.debug('3/4分')
         
-        #print(Gfile)
-        #OPen the GRIMM file
-        dG=open(Gfile, 'r')
-        #Loop through each line
-        firstP = 0 #deal with no P in the first reading
-        for line in dG:
-            #print(firstP) #check
-            #print(line) #check
-            #Split up the line 
-            GBits=line.split()
-            id=GBits[6] #Is it data or not
-            #print(GBits) #cjecl
-            if id == "P": #Then its date and time data 
-                # print(id) #Check
-               #  print(GBits[0:6])
-                 year,month,day,hour,m = GBits[0:5] #get the time data
-                # year = "20" + year
-                 firstP = 1
-            elif  firstP == 1: #Now we are Past the time data, we can read the bin data
-                c=GBits[6]  #Iver a big C (1st 8 bins) or a little c (rest of the bins)
-                #print(id) #cjecl
-               #This is done of the GRIMM takes 2 reading in 6 seconds, One for the smaller partiles i,e First 8 bins
-               #and the next for the larger partiles (c)
-                #bin_data=[]
-                if "C" in c:
-                    BD=GBits[7:]
-                elif "c" in c:
-                    #taking the min and seconds are the c reading time 
-                    minsec=GBits[5] # min and seconds are attaced and need there own split
-                    msSplit=minsec.split(".")
-                    second=msSplit[0]
-                    #second=msSplit[1]# its given as fraction of a miniute 
-                    #second convertion
-                    #second=int(60*(float(second)/1000))
-                    #Add to last lines data from C
-                    BD = BD + GBits[7:14]
-                    #add all times into a datetime format 
-                   # print(len(BD))
-                    time = dt(int(year),int(month),int(day),int(hour),int(m),int(second))
-                    Gdata.loc[i]=[time,int(BD[0]),int(BD[1]),int(BD[2]),int(BD[3]),int(BD[4]),int(BD[5]),int(BD[6]),int(BD[7]),int(BD[8]),int(BD[9]),int(BD[10]),int(BD[11]),int(BD[12]),int(BD[13]),int(BD[14])]
-                    i=i+1
-        #set time as index    
-    #print(Gdata)         
-    Gdata.set_index('time', inplace=True, drop=True)
+        #OPen the GRIMM file and read the complete records 
+        with open(Gfile, 'r') as dG:
+            for time,BD in GRIMMrecords(dG):
+                times.append(time)
+                counts.append(BD)
+    #build the DataFrame in one go and set time as index    
+    Gdata=pd.DataFrame(counts,columns=GBin,index=pd.DatetimeIndex(times,name="time"))
     Gdata=Gdata.astype(int) #deal with string data
     return Gdata
 
 
-def binmass(data,size):
-    #print(data)
-    for s in size:
-        col=str(s)+"um"
-        print(col,s)
-        v=4/3*mp.pi*((s*10**(-6))/2)**3 
-       # print(data[col])
-        m=data[col]*1.65e+12 # volume * count * density   
-        flowrate=1.149*1.6667e-5 #l/min to m^3/s
-        period=6 #12 second sampe period
-        M=(m*v) /(flowrate*period)
-        data[str(s)+"M"]=M
-        
-    s = [str(i)+"M" for i in size]    #conver the size into string for the columns in the panda arrau
-   # print(s[0:6],s[6:8],s[8:13])
-    data["pm1"]=data[s[0:6]].sum(axis = 1, skipna = True)
-    data["pm2"]=data[s[0:8]].sum(axis = 1, skipna = True)
-    data["pm10"]=data[s[0:13]].sum(axis = 1, skipna = True)
-    data["pm20"]=data[s].sum(axis = 1, skipna = True)
-    print(data["pm10"])
+def GRIMMrecords(lines):
+    """
+    Generator turning GRIMM P/C/c protocol lines into complete records of (time, 15 bin counts).
+    lines can be any iterable of str or bytes lines, i.e. an open .GRIMM file, followlines or seriallines.
+    The P line holds the date and time, the GRIMM then takes 2 readings, a big C line with the first
+    8 bins (smaller particles) and a little c line with the rest of the bins (larger particles).
+    Only the current P and C lines are kept, so memory is bounded however long the stream is.
+    """
+    P=None #deal with no P in the first reading
+    BD=None
+    for line in lines:
+        if isinstance(line,bytes):
+            line=line.decode("ascii","ignore")
+        #Split up the line 
+        GBits=line.split()
+        if len(GBits)<7: #partial or empty line
+            continue
+        id=GBits[6] #Is it data or not
+        if id == "P": #Then its date and time data 
+            P=GBits[0:5] #year,month,day,hour,min
+            BD=None
+        elif P is not None: #Now we are Past the time data, we can read the bin data
+            if "C" in id:
+                BD=GBits[7:]
+            elif "c" in id and BD is not None:
+                #min and seconds are attaced and need there own split, take the seconds of the c reading
+                second=GBits[5].split(".")[0]
+                year,month,day,hour,m=P
+                try:
+                    time=dt(int(year),int(month),int(day),int(hour),int(m),int(second))
+                    record=[int(b) for b in (BD+GBits[7:14])[0:15]]
+                except ValueError: #corrupt line, drop the record
+                    record=[]
+                if len(record)==15:
+                    yield time,record
+                BD=None
+
+
+def followlines(filename,poll=1.0,timeout=None,maxline=1024):
+    """
+    Follow a file as it is being written (like tail -f) and yield the complete lines.
+    Waits poll seconds for new data, stops after timeout seconds with no new data (None = never).
+    Partial lines longer than maxline are dropped to keep the memory bounded.
+    """
+    with open(filename,"r") as f:
+        part=""
+        idle=0
+        while True:
+            line=f.readline()
+            if line:
+                idle=0
+                part=part+line
+                if part.endswith("\n"):
+                    yield part
+                    part=""
+                elif len(part)>maxline:
+                    part=""
+                continue
+            if timeout is not None and idle>=timeout:
+                return
+            sleep(poll)
+            idle=idle+poll
+
+
+def seriallines(conn,timeout=None,maxline=1024):
+    """
+    Yield complete lines from a serial like connection, anything with a readline() that
+    returns bytes or str and an empty value when its own read timeout runs out
+    (a pyserial Serial, or a pty for testing).
+    Stops after timeout seconds with no data (None = never), or at the end of the stream:
+    an empty read from a connection without a read timeout (a file or a pty, rather than
+    a Serial with timeout set), or an EIO error (the writer of a pty closed).
+    """
+    eof=getattr(conn,"timeout",None) is None #an empty read is the end, not a read timeout
+    part=b""
+    last=monotonic()
+    while True:
+        try:
+            line=conn.readline()
+        except OSError as e:
+            if e.errno==errno.EIO:
+                return
+            raise
+        if isinstance(line,str):
+            line=line.encode("ascii","ignore")
+        if line:
+            last=monotonic()
+            part=part+line
+            if part.endswith(b"\n"):
+                yield part
+                part=b""
+            elif len(part)>maxline:
+                part=b""
+        elif eof or (timeout is not None and monotonic()-last>=timeout):
+            return
+
+
+def streamGRIMM(source,baud_rate=9600,timeout=None,poll=1.0):
+    """
+    Stream complete GRIMM records (time, 15 bin counts) live.
+    source is a serial port name (i.e. "/dev/ttyUSB0"), a .GRIMM file being written,
+    or an already open serial like object.
+    Generator, so the GRIMM can be logged in the same loop as the SDS sensors.
+    """
+    if hasattr(source,"readline"):
+        for record in GRIMMrecords(seriallines(source,timeout)):
+            yield record
+    elif source.startswith("/dev/"):
+        import serial #only needed for live data
+        conn=serial.Serial(port=source,baudrate=baud_rate,timeout=1)
+        try:
+            for record in GRIMMrecords(seriallines(conn,timeout)):
+                yield record
+        finally:
+            conn.close()
+    else:
+        for record in GRIMMrecords(followlines(source,poll,timeout)):
+            yield record
+
+
+#GRIMM 1.108 bin sizes (um) and the default sample settings used for the mass conversion
+GRIMMsize=[0.3,0.4,0.5,0.65,0.8,1,1.6,2,3,4,5,7.5,10,15,20]
+density=1.65e+12 #particle density in ug/m^3 (1.65 g/cm^3)
+flowrate=1.149*1.6667e-5 #l/min to m^3/s
+period=6 #6 second sample period
+pmcuts=[1,2,10,20] #upper sizes for pm1, pm2, pm10 and pm20
+
+
+def massarray(counts,size,density=density,flowrate=flowrate,period=period,cuts=pmcuts):
+    """
+    Pure compute version of binmass.
+    Takes a count matrix (rows x bins, in the same order as size) and returns the per bin
+    masses and the cumulative PM fractions (rows x cuts) as numpy arrays.
+    A PM fraction is the sum of all the bins with a size <= its cut.
+    All bins are done in one broadcasted operation, so it can be run over millions of rows.
+    """
+    counts=np.asarray(counts,dtype=float)
+    size=np.asarray(size,dtype=float)
+    #mass of one particle in each bin (volume * density) spread over the sampled air volume
+    v=4/3*np.pi*((size*10**(-6))/2)**3
+    masses=counts*(v*density/(flowrate*period))
+    #cumulative sum over the bins, nan bins are skipped like the pandas sum
+    cum=np.nancumsum(masses,axis=1)
+    last=np.searchsorted(size,cuts,side="right")-1
+    return masses,cum[:,last]
+
+
+def binmass(data,size,density=density,flowrate=flowrate,period=period,plot=False):
+    """
+    Add the mass of each bin ("<s>M" columns) and pm1/pm2/pm10/pm20 to the GRIMM data.
+    density (ug/m^3), flowrate (m^3/s) and period (s) can be set for other instruments.
+    Plotting is a separate step, use plot=True or call plotbinmass.
+    """
+    cols=[str(s)+"um" for s in size]
+    s=[str(i)+"M" for i in size]    #conver the size into string for the columns in the panda arrau
+    masses,pms=massarray(data[cols].values,size,density,flowrate,period)
+    for i,col in enumerate(s):
+        data[col]=masses[:,i]
+    for i,col in enumerate(["pm1","pm2","pm10","pm20"]):
+        data[col]=pms[:,i]
+    if plot:
+        plotbinmass(data)
+    return data
+
+
+def plotbinmass(data,ave="15min"):
+    """
+    Plot pm1, pm2 and pm10 from binmass as a time series, averaged over ave
+    """
     fig,ax = plt.subplots(1,1,figsize=(8,8))
-    Data=data.resample("15T").mean()
-  #  data["pm2","pm10"].plot()
+    Data=data[["pm1","pm2","pm10"]].resample(ave).mean()
     ax.set_ylim([0,100])
     ax.plot(Data["pm1"])
     ax.plot(Data["pm2"])
     ax.plot(Data["pm10"])
-    return data
+    return fig,ax
     
     
 def voldist(data,size):
@@ -177,11 +293,11 @@ def sizedist(data,size):
         try:
             col=str(S)+"um"
             content=data[col]  
-        except:
+        except KeyError:
             col="b"+str(i)
             content=data[col]  
             pass
-        print(col)
+        logger.debug('%s', col)
           
         u=content.mean()
         N=content.sum()
@@ -213,13 +329,61 @@ def sizedist(data,size):
     Sizedata["dN/dr"] 
     return Sizedata
 
+def binedges(size):
+    """
+    Bin edges (um) for the GRIMM sizes, each size is the lower edge of its bin.
+    The last bin is open so its upper edge is set one log step above the last size.
+    """
+    size=np.asarray(size,dtype=float)
+    return np.append(size,size[-1]**2/size[-2])
+
+
+def sizedisttime(data,size,ave="15min",flowrate=flowrate,period=period):
+    """
+    Time resolved size distributions for all the bins in one vectorized pass.
+    The counts are averaged over each ave time window (i.e. "15min" or "1h"), turned into
+    number concentrations (#/cm^3) and then into dN/dlogD, dA/dlogD (um^2/cm^3)
+    and dV/dlogD (um^3/cm^3) using the geometric mid point size of each bin.
+    Returns a dict with the window times, the mid point sizes and a (time x bin) array
+    for each distribution, ready for plotsizedisttime or any other heatmap.
+    """
+    cols=[str(s)+"um" for s in size]
+    #one resample for the whole count matrix
+    counts=data[cols].resample(ave).mean()
+    edges=binedges(size)
+    dlogD=np.diff(np.log10(edges))
+    Dp=np.sqrt(edges[:-1]*edges[1:])
+    #counts per sample to #/cm^3
+    N=counts.values/(flowrate*period*1e6)
+    dN=N/dlogD
+    dist={}
+    dist["time"]=counts.index
+    dist["size"]=Dp
+    dist["dN/dlogD"]=dN
+    dist["dA/dlogD"]=np.pi*Dp**2*dN
+    dist["dV/dlogD"]=np.pi/6*Dp**3*dN
+    return dist
+
+
+def plotsizedisttime(dist,var="dN/dlogD"):
+    """
+    Heatmap of a time resolved size distribution from sizedisttime
+    """
+    fig,ax= plt.subplots(1,1,figsize=(12,6))
+    mesh=ax.pcolormesh(dist["time"],dist["size"],dist[var].T,shading="nearest")
+    ax.set_yscale("log")
+    ax.set_ylabel("size um")
+    fig.colorbar(mesh,ax=ax,label=var)
+    return fig,ax
+
+
 Folder="Data-old//JimsOffice-Data//GRIMM//"
     #Folder for GRIMM data
 #size = [0.3,0.4,0.5,0.65,0.8,1,1.6,2,3,4,5,7.5,10,15,20]
     
 yearmonth="1905"
 #GRIMMdf=pandaGRIMM(Folder,yearmonth)
-#data=binmass(GRIMMdf,size,"15T")
+#data=binmass(GRIMMdf,GRIMMsize)
 #a=voldist(GRIMMdf,size)   
 #GRIMMdf.to_csv("GRIMM_20"+yearmonth+".csv",encoding='utf-8')
     
@@ -6,7 +6,29 @@ Created on Thu May 16 10:34:24 2019
 Createthe live dash HDML
 """
 
-def genLivedash(locname,filename,cols):
+import base64
+import json
+import logging
+import struct
+import numpy as np
+import pandas as pd
+from AQCache import codeversion, fingerprint, isfresh, stamp
+from AQTiming import timed, written
+
+logger=logging.getLogger(__name__)
+
+@timed()
+def genLivedash(locname,filename,cols,cache=True):
+    """
+    Write the dashboard page, buttons for each varaible in cols loading its plot
+    cache: skip writing the page if it is already made for the same varaibles (see AQCache)
+    """
+    pagename="Plots//"+locname+filename+".html"
+    if cache:
+        key=fingerprint(filename,cols,codeversion(__file__))
+        if isfresh(pagename,key):
+            logger.info('Dashboard up to date')
+            return
     rows="""
     
     """
@@ -16,7 +38,7 @@ def genLivedash(locname,filename,cols):
     for col in cols:
         row='<a href=" '+filename+'-'+col+'.html" target="plot"><button type="button" >'+col+'</button></a>'
         rows=rows+row
-    print(rows)
+    logger.debug('%s', rows)
     
     #add rows and avariabls into html 
     
@@ -81,9 +103,263 @@ def genLivedash(locname,filename,cols):
     
     
     """
-    print("Generate Dashboard")
-    pagename="Plots//"+locname+filename+".html"
+    logger.info('Generate Dashboard')
     file = open(pagename,"w+") #open file in binary mode
     file.writelines(html)
     file.close()
+    written(pagename)
+    if cache:
+        stamp(pagename,key)
     
+
+
+mapcols=["STATICMAP","GPSWALK"] #varaibles made as map pages, not drawn from the data file
+
+
+def varcolumn(df,var):
+    """
+    Name of the data column of a varaible, the SDS and OPC files name their columns
+    sds-<var> (ratios sds-<a>VSsds-<b>) and OPC-<var>, None if the data does not have it
+    """
+    names=[var,"sds-"+var,"OPC-"+var]
+    if "VS" in var:
+        names.append("sds-"+var.replace("VS","VSsds-"))
+    for name in names:
+        if name in df.columns:
+            return name
+    return None
+
+
+def packdata(Datas,cols):
+    """
+    Pack the varaibles in cols of every sensor in Datas into one binary data file:
+    a 4 byte header length, the JSON header and then the arrays, float64 times (ms)
+    and float32 values (NaN for missing) each starting on an 8 byte boundary.
+    The header lists the sensors with the offset of their time and varaible arrays.
+    Returns the file bytes
+    """
+    header={"vars":cols,"sensors":[]}
+    blocks=[]
+    offset=0
+    def add(array):
+        nonlocal offset
+        data=array.tobytes()
+        data=data+bytes(-len(data)%8)
+        blocks.append(data)
+        offset=offset+len(data)
+        return offset-len(data)
+    for k,df in Datas.items():
+        times=pd.to_datetime(df["time"]) if "time" in df.columns else pd.to_datetime(df.index)
+        sensor={"name":k,"n":len(df),"t":add(np.asarray(times,dtype="datetime64[ms]").astype("<f8")),"cols":{}}
+        for var in cols:
+            col=varcolumn(df,var)
+            if col is not None:
+                values=pd.to_numeric(df[col],errors="coerce").values
+                sensor["cols"][var]=add(values.astype("<f4"))
+        header["sensors"].append(sensor)
+    head=json.dumps(header,separators=(",",":")).encode("utf8")
+    head=head+b" "*(-(len(head)+4)%8)
+    return struct.pack("<I",len(head))+head+b"".join(blocks)
+
+
+@timed(rows=2)
+def genDatadash(locname,filename,Datas,cols,cache=True):
+    """
+    Write the data dashboard, one page drawing any varaible of any sensor in the browser
+    from one compact data file (see packdata) instead of a pre made plot for each varaible.
+    The map varaibles (mapcols) are still made as their own pages and shown in a frame.
+    The data file is written as a script (<filename>-data.js, the packed bytes in base64)
+    loaded by the page, so it opens as a file without a web server.
+    cache: skip writing the files if they are already made from the same data (see AQCache)
+    """
+    pagename="Plots//"+locname+filename+".html"
+    dataname=filename+"-data.js"
+    maps=[col for col in cols if col.upper() in mapcols]
+    plotcols=[col for col in cols if col.upper() not in mapcols]
+    if cache:
+        key=fingerprint(Datas,cols,filename,codeversion(__file__))
+        if isfresh(pagename,key,[pagename,"Plots//"+locname+dataname]):
+            logger.info('Dashboard up to date')
+            return
+    with open("Plots//"+locname+dataname,"w") as f:
+        f.write('dashdata("'+base64.b64encode(packdata(Datas,plotcols)).decode("ascii")+'");\n')
+    buttons="".join('<button data-var="'+col+'">'+col+'</button>' for col in plotcols)
+    buttons=buttons+"".join('<button data-map="'+filename+'-'+col+'.html">'+col+'</button>' for col in maps)
+    html="""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>"""+filename+"""</title>
+<style>
+body { background-color: #f0f8ff; font: 13px sans-serif; margin: 10px; }
+.btn-group { float: left; width: 140px; margin-right: 20px; }
+.btn-group button { background-color: #e6e6fa; border: 1px solid blue; color: blue;
+    padding: 10px; cursor: pointer; width: 100%; display: block; }
+.btn-group button.on { background-color: blue; color: white; }
+#view { float: left; }
+#legend span { margin-right: 15px; cursor: pointer; }
+</style>
+</head>
+<body>
+<div class="btn-group"><button disabled>Variables</button>"""+buttons+"""</div>
+<div id="view">
+<div id="plot"><h3 id="title"></h3><canvas id="chart" width="1200" height="640"></canvas><div id="legend"></div></div>
+<iframe id="map" width="1200" height="700" frameBorder="0" style="display:none"></iframe>
+</div>
+<script>
+var colors = ["#e6194b", "#3cb44b", "#4363d8", "#f58231", "#911eb4", "#42d4f4", "#f032e6", "#9a6324"];
+var data = null, current = null, hidden = {};
+function load(buffer) {
+    var n = new DataView(buffer).getUint32(0, true);
+    var header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 4, n)));
+    var start = 4 + n;
+    header.sensors.forEach(function (s) {
+        s.time = new Float64Array(buffer, start + s.t, s.n);
+        s.values = {};
+        for (var v in s.cols) { s.values[v] = new Float32Array(buffer, start + s.cols[v], s.n); }
+    });
+    return header;
+}
+function label(ms, span) {
+    var d = new Date(ms), hm = ("0" + d.getUTCHours()).slice(-2) + ":" + ("0" + d.getUTCMinutes()).slice(-2);
+    return span > 2 * 864e5 ? d.toISOString().slice(5, 10) + " " + hm : hm;
+}
+function draw(v) {
+    current = v;
+    document.getElementById("plot").style.display = "";
+    document.getElementById("map").style.display = "none";
+    document.getElementById("title").textContent = """+json.dumps(filename)+""" + " ( " + v + " )";
+    var canvas = document.getElementById("chart"), ctx = canvas.getContext("2d");
+    var W = canvas.width, H = canvas.height, L = 60, R = 10, T = 10, B = 30;
+    ctx.clearRect(0, 0, W, H);
+    var sensors = data.sensors.filter(function (s) { return s.values[v] && !hidden[s.name]; });
+    var t0 = Infinity, t1 = -Infinity, lo = Infinity, hi = -Infinity;
+    sensors.forEach(function (s) {
+        var y = s.values[v];
+        for (var i = 0; i < s.n; i++) {
+            if (y[i] === y[i]) {
+                lo = Math.min(lo, y[i]); hi = Math.max(hi, y[i]);
+                t0 = Math.min(t0, s.time[i]); t1 = Math.max(t1, s.time[i]);
+            }
+        }
+    });
+    if (!isFinite(lo)) { lo = 0; hi = 1; t0 = 0; t1 = 1; }
+    if (hi == lo) { hi = lo + 1; }
+    if (t1 == t0) { t1 = t0 + 1; }
+    var w = W - L - R, h = H - T - B;
+    function x(t) { return L + (t - t0) / (t1 - t0) * w; }
+    function y(val) { return T + h - (val - lo) / (hi - lo) * h; }
+    ctx.strokeStyle = "#ccc"; ctx.fillStyle = "#000"; ctx.font = "12px sans-serif";
+    for (var i = 0; i <= 5; i++) {
+        var val = lo + (hi - lo) * i / 5, t = t0 + (t1 - t0) * i / 5;
+        ctx.beginPath(); ctx.moveTo(L, y(val)); ctx.lineTo(W - R, y(val)); ctx.stroke();
+        ctx.textAlign = "right"; ctx.fillText(val.toFixed(1), L - 4, y(val) + 4);
+        ctx.textAlign = "center"; ctx.fillText(label(t, t1 - t0), x(t), H - 10);
+    }
+    data.sensors.forEach(function (s, j) {
+        if (sensors.indexOf(s) < 0) { return; }
+        var yv = s.values[v], col = -1, mn = 0, mx = 0, last = null;
+        ctx.strokeStyle = colors[j % colors.length];
+        ctx.beginPath();
+        //one min / max stroke per pixel column, so long series draw as fast as short ones
+        function flush() {
+            if (col < 0) { return; }
+            if (last === null) { ctx.moveTo(col, y(mn)); } else { ctx.lineTo(col, last); }
+            ctx.lineTo(col, y(mn)); ctx.lineTo(col, y(mx));
+            last = y(mx);
+        }
+        for (var i = 0; i < s.n; i++) {
+            var val = yv[i];
+            if (val !== val) { flush(); col = -1; last = null; continue; }
+            var c = Math.round(x(s.time[i]));
+            if (c != col) { flush(); col = c; mn = val; mx = val; }
+            else { mn = Math.min(mn, val); mx = Math.max(mx, val); }
+        }
+        flush();
+        ctx.stroke();
+    });
+    var legend = document.getElementById("legend");
+    legend.innerHTML = "";
+    data.sensors.forEach(function (s, j) {
+        if (!s.values[v]) { return; }
+        var span = document.createElement("span");
+        span.style.color = colors[j % colors.length];
+        span.style.opacity = hidden[s.name] ? 0.3 : 1;
+        span.textContent = "\u25A0 " + s.name;
+        span.onclick = function () { hidden[s.name] = !hidden[s.name]; draw(current); };
+        legend.appendChild(span);
+    });
+}
+function select(button) {
+    document.querySelectorAll(".btn-group button").forEach(function (b) { b.className = ""; });
+    button.className = "on";
+    if (button.dataset.map) {
+        document.getElementById("plot").style.display = "none";
+        var frame = document.getElementById("map");
+        frame.style.display = "";
+        if (frame.getAttribute("src") != button.dataset.map) { frame.src = button.dataset.map; }
+    } else if (data) {
+        draw(button.dataset.var);
+    }
+}
+document.querySelectorAll(".btn-group button[data-var], .btn-group button[data-map]").forEach(function (b) {
+    b.onclick = function () { select(b); };
+});
+//called by the data script with the packed data file in base64
+function dashdata(packed) {
+    var bin = atob(packed), bytes = new Uint8Array(bin.length);
+    for (var i = 0; i < bin.length; i++) { bytes[i] = bin.charCodeAt(i); }
+    data = load(bytes.buffer);
+    var first = document.querySelector(".btn-group button[data-var], .btn-group button[data-map]");
+    if (first) { select(first); }
+}
+</script>
+<script src="""+json.dumps(dataname)+"""></script>
+</body>
+</html>
+"""
+    logger.info('Generate Data Dashboard')
+    with open(pagename,"w") as f:
+        f.write(html)
+    written(pagename,"Plots//"+locname+dataname)
+    if cache:
+        stamp(pagename,key)
+
+
+@timed()
+def genIndex(filename,pages):
+    """
+    Write Plots//<filename>-index.html, a table of links to the dashboards with a row
+    for each device and a column for each day, pages is {device: {day: page name}}
+    (names relative to the Plots folder)
+    """
+    days=sorted({day for device in pages.values() for day in device})
+    rows="<tr><th>Device</th>"+"".join("<th>"+day+"</th>" for day in days)+"</tr>\n"
+    for device in sorted(pages):
+        rows=rows+"<tr><td>"+device+"</td>"
+        for day in days:
+            page=pages[device].get(day)
+            rows=rows+("<td><a href='"+page.replace("//","/")+"'>"+day[8:]+"</a></td>" if page else "<td></td>")
+        rows=rows+"</tr>\n"
+    html="""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>"""+filename+"""</title>
+<style>
+body { background-color: #f0f8ff; font: 13px sans-serif; }
+td, th { border: 1px solid blue; padding: 4px 8px; text-align: center; }
+table { border-collapse: collapse; }
+</style>
+</head>
+<body>
+<h3>"""+filename+"""</h3>
+<table>
+"""+rows+"""</table>
+</body>
+</html>
+"""
+    logger.info('Generate Index')
+    with open("Plots//"+filename+"-index.html","w") as f:
+        f.write(html)
+    written("Plots//"+filename+"-index.html")
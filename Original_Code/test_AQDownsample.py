@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the plot downsampling, spikes and gaps are kept and missing data does not raise
+"""
+
+import numpy as np
+import pandas as pd
+
+from AQDownsample import downsample, minmaxbuckets
+
+times=pd.date_range("2019-07-16",periods=10000,freq="s")
+
+
+def test_minmax_keeps_spike():
+    y=np.zeros(len(times))
+    y[1234]=500
+    kept=downsample(pd.Series(y,index=times),200)
+    assert len(kept)<=200 and kept.max()==500
+
+
+def test_minmax_all_missing():
+    #an all NaN series longer than target is cut down to its gaps rather than raising
+    y=np.full(len(times),np.nan)
+    kept=minmaxbuckets(times.asi8,y,200)
+    assert 0<len(kept)<=100 and kept[0]==0
+    assert downsample(pd.Series(y,index=times),200).isna().all()
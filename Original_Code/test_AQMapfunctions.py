@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the site join, the walk readings are joined to the nearest site within a radius
+"""
+
+import numpy as np
+import pandas as pd
+
+from AQMapfunctions import SiteIndex, sitejoin
+
+#two sites about 1.1 km apart
+sites=pd.DataFrame({"Site":["A","B"],"Lat":[53.800,53.810],"lon":[-1.550,-1.550]})
+
+
+def test_join_nearest():
+    index=SiteIndex(sites["Lat"].values,sites["lon"].values,sites["Site"].values)
+    near,dist=index.join([53.8001,53.8099,53.805],[-1.550,-1.550,-1.550],100)
+    assert list(near)==[0,1,-1]
+    assert dist[0]<20 and dist[1]<20 and np.isnan(dist[2])
+
+
+def test_join_no_match():
+    #a walk far from every site joins to none of them
+    index=SiteIndex(sites["Lat"].values,sites["lon"].values,sites["Site"].values)
+    near,dist=index.join([53.90,53.91],[-1.40,-1.41],100)
+    assert list(near)==[-1,-1]
+    assert np.isnan(dist).all()
+    stats=index.aggregate([53.90,53.91],[-1.40,-1.41],[10,12],100)
+    assert len(stats)==0
+
+
+def test_sitejoin_no_match():
+    data=pd.DataFrame({"lat":[53.90,53.91],"lon":[-1.40,-1.41]})
+    data=sitejoin(data,sites,100)
+    assert data["Site"].isna().all()
+    assert data["sitedist"].isna().all()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the GRIMM stream reader, using a pty as a stand in for the serial port
+(the GRIMM writes to the slave end, the reader reads the master end like a Serial)
+"""
+
+import os
+import pty
+import threading
+from datetime import datetime as dt
+from time import monotonic
+
+from GRIMM import seriallines, streamGRIMM
+
+#one GRIMM record, P (date and time), C (first 8 bins) and c (last 7 bins) lines
+record=[
+    "2019 4 12 9 52 0 P 1 2 3 4\n",
+    "2019 4 12 9 52 6.0 C0 10 11 12 13 14 15 16 17\n",
+    "2019 4 12 9 52 12.0 c0 18 19 20 21 22 23 24\n",
+]
+
+
+def fakeGRIMM(lines,hold=None):
+    """
+    Open a pty and write lines to the slave end from a thread, waiting for hold (an event)
+    before closing it. Returns the master end opened for reading and the thread
+    """
+    master,slave=pty.openpty()
+    def write():
+        for line in lines:
+            os.write(slave,line.encode("ascii"))
+        if hold is not None:
+            hold.wait()
+        os.close(slave)
+    writer=threading.Thread(target=write)
+    writer.start()
+    return os.fdopen(master,"rb",buffering=0),writer
+
+
+def test_stream_pty_records():
+    conn,writer=fakeGRIMM(record*2)
+    records=list(streamGRIMM(conn))
+    writer.join()
+    conn.close()
+    assert records==[(dt(2019,4,12,9,52,12),list(range(10,25)))]*2
+
+
+def test_stream_pty_partial_line():
+    #a line split over two writes is still read as one line
+    lines=record[:2]+[record[2][:10],record[2][10:]]
+    conn,writer=fakeGRIMM(lines)
+    records=list(streamGRIMM(conn))
+    writer.join()
+    conn.close()
+    assert len(records)==1
+
+
+def test_seriallines_ends_on_closed_pty():
+    #the writer closing the pty ends the stream (EIO) rather than raising
+    hold=threading.Event()
+    conn,writer=fakeGRIMM(record,hold)
+    lines=seriallines(conn)
+    first=next(lines)
+    hold.set()
+    rest=list(lines)
+    writer.join()
+    conn.close()
+    assert first.strip()==record[0].strip().encode()
+    assert len(rest)==2
+
+
+def test_seriallines_ends_at_eof(tmp_path):
+    #a file at its end stops the reader rather than spinning
+    filename=tmp_path/"data.GRIMM"
+    filename.write_text("".join(record))
+    with open(filename,"rb") as f:
+        assert len(list(seriallines(f)))==3
+
+
+class TimeoutPort(object):
+    """
+    Serial stand in whose read timeout has run out, readline always returns b""
+    """
+    timeout=0.01
+
+    def readline(self):
+        return b""
+
+
+def test_seriallines_read_timeout():
+    #empty reads from a port with a read timeout are waited through until timeout
+    start=monotonic()
+    assert list(seriallines(TimeoutPort(),timeout=0.2))==[]
+    assert monotonic()-start>=0.2
@@ -10,28 +10,49 @@ Matched time and date from Dates keyword
 
 And plots a number of html files.  The map one is called STATICMAP.
 
+Run from the command line, python AQDataplot.py --help for the options,
+the settings below are the defaults and can also be given in a JSON config file.
+The plotting and map libraries are only imported when an output needs them (see load),
+so python AQDataplot.py --summary (a summary of the data files) starts quickly.
+
 """
 
 
-import matplotlib.pylab as plt
-import mpld3
-import pandas as pd
+import argparse
+import importlib
+import json
+import logging
+import time
 import glob 
-import numpy as np
-import AQMapfunctions as AQMap
 import csv
 import os 
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from datetime import timedelta
-from Genlivehtml import genLivedash 
 import sys 
 import codecs
+import AQTiming #run timing, standard library only so quick to import
 
+logger=logging.getLogger(__name__)
 
 #Code to run the functions
+mapcols=["STATICMAP","GPSWALK"] #varaibles made as maps (as in Genlivehtml)
 Sens=["SDS"]
 vals=["pm2.5", "pm10", "STATICMAP"]   #OPTIONS: "GPSWALK" for GPS data ,"STATICMAP" static plot map but also works with GPS data  #colums
 ave="1T" #Data avaergae for plotting 
+maxpoints=2000 #points per line in the plots, longer series are downsampled (None to plot all)
+method="minmax" #downsampling, "minmax" (keeps every spike) or "lttb"
+workers=None #processes making the plots, None for one per core, 1 to plot in turn
+cache=True #only remake the plots whose data, settings or code changed
+dashboard="plots" #"plots": a page of the mpld3 plots, "data": one page drawing the plots in the browser from one data file
+#render profiles, what is made for each varaible: png / pdf / svg images at dpi, the mpld3 html plot,
+#the maps and the dashboard page
+profiles={
+    "draft":{"dpi":72,"formats":["png"],"html":False,"maps":False,"dashboard":False},
+    "web":{"dpi":100,"formats":["png"],"html":True,"maps":True,"dashboard":True},
+    "print":{"dpi":300,"formats":["png","pdf"],"html":False,"maps":False,"dashboard":False},
+}
+profile="web" #render profile used
 #Get date for today and yesterday
 today=datetime.today().strftime("%Y-%m-%d")
 yesterday=datetime.today() - timedelta(days=1)
@@ -43,6 +64,21 @@ Dates=["11-07-2019"]
 filename="AQDashboard"
 #Generate PLOT
 DataFolder=""  #data folder locations !!!!!!!!!
+max_number_sensors=4 #sds01 to sds0N columns in the data file
+importtimes={} #seconds taken by each library imported with load
+
+
+def load(name):
+    """
+    Import a library when an output first needs it, so runs that do not make that output
+    do not pay for it, recording how long the import took in importtimes
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    start=time.perf_counter()
+    module=importlib.import_module(name)
+    importtimes[name]=time.perf_counter()-start
+    return module
 
 #def droperror(data,col,limit,condition):
 #    '''
@@ -78,7 +114,9 @@ def genratio(Data,col1,col2):
     Data[rationame]=Data[col1]/Data[col2]
     return Data
 
+@AQTiming.timed(rows="result")
 def GetDataset(Folder,sensors,ave):
+    pd=load("pandas")
     Data={}#set array to hold file names
     infos={}
     #  folder=Folder
@@ -93,7 +131,7 @@ def GetDataset(Folder,sensors,ave):
                #1 print(file)
         sfiles=sorted(sfiles)
        # print(len(sfiles))
-        print(sfiles)
+        logger.debug('%s', sfiles)
         data=pd.DataFrame()
         file=""
         if len(sfiles)==1:
@@ -103,11 +141,11 @@ def GetDataset(Folder,sensors,ave):
                 row=""
                 for i, row in  enumerate(test):
                     if "time" in row:
-                        print(i,row)
+                        logger.debug('%s %s', i, row)
                         header=i
       
              data=pd.read_csv(file,header=header,error_bad_lines=False,engine='python')
-             print(data)
+             logger.debug('%s', data)
              #if "SDS" in sensor:
              #    data=data.loc[:,"time":"sds-pm10"]
              #else:    
@@ -138,41 +176,10 @@ def GetDataset(Folder,sensors,ave):
             for row in reader:
                 i=i+1
                 if i<header:
-                    print(row)
+                    logger.debug('%s', row)
                     rowinfo=rowinfo=list(filter(None,row[1:5]))
                     info[row[0]]=rowinfo
-        print("*****************************")
-        print("Printig Data file info ",info)
-        print("")
-        print("")
-        print("")
-        print("")
-        print("")
-        print("")
-        print("")
-        print("")
-        print("")
-        print("")
-        print("")
-        print("")
-        print("")
-        print("")
-        print("")
-        print("")
-        print("")
-        print("")
-        print("")
-        print("")
-        print("")
-        print("")
-        print("")
-        print("")
-        print("")
-        print("")
-        print("")
-        print("")
-        print("")
-        print("*****************************")
+        logger.debug('Data file info %s', info)
                     
     
     
@@ -189,11 +196,8 @@ def GetDataset(Folder,sensors,ave):
         data["time"]=pd.to_datetime(data.time)   
         data.set_index('time', inplace=True)  
         
-        print("---------------"+sen+" Data Check-----------------------------")
-        print("-----------------Data------------------")
-        print(data.head(4))
-        print("--------------Data columns-------------------------------")
-        print(data.columns)
+        logger.debug('%s data check\n%s', sen, data.head(4))
+        logger.debug('%s data columns %s', sen, list(data.columns))
         
         if "SDS" in sensor:
             #add ratio
@@ -206,6 +210,7 @@ def GetDataset(Folder,sensors,ave):
             data=gencount(data)
 
         if ave != "RAW": #If there is a avearege then get mean, if RAW dont take mean
+          with AQTiming.stage("resample",len(data)):
             #print(data.dtypes)
             for k,c in data.iteritems():
                 typ=str(c.dtype)
@@ -218,7 +223,8 @@ def GetDataset(Folder,sensors,ave):
          #   print(data.columns)
          
         #drop odd data, negative and unreal values   
-        for col in data.columns :
+        with AQTiming.stage("QC",len(data)):
+          for col in data.columns :
              if "pm" in col:   
                  try:
                      data=droperror(data,col,1000,"greater")
@@ -242,48 +248,68 @@ def GetDataset(Folder,sensors,ave):
 
 
 
-def createdir(dirname):
-    date=datetime.today().strftime("%Y%m%d")
+def selectdates(df,Dates):
+    """
+    The readings of df in Dates, a day ["2019-04-30"] or a start and end day
+    ["2019-04-29","2019-04-30"] (both days included), with a time index.
+    Data with a time column rather than a time index (i.e. from splitsensors) are indexed by it
+    """
+    pd=load("pandas")
+    if not isinstance(df.index,pd.DatetimeIndex):
+        df=df.set_axis(pd.DatetimeIndex(pd.to_datetime(df["time"]).values))
+    start=pd.Timestamp(Dates[0])
+    end=pd.Timestamp(Dates[-1])+pd.Timedelta(days=1)
+    return df[(df.index>=start) & (df.index<end)]
+
+
+def createdir(dirname,Dates=None):
+    """
+    Make the output folder Plots//<dirname>_<Dates>, named by the dates of the data plotted
+    (not the day of the run) so a later run of the same data finds the outputs and cache stamps
+    made before. Today's date if Dates are not given. Returns the folder name ending in //
+    """
+    date="--".join(Dates[:2]) if Dates else datetime.today().strftime("%Y%m%d")
     dirname=dirname+"_"+date
     if not os.path.exists("Plots//"+dirname):
-        os.mkdir("Plots//"+dirname)
-    else:
-        dirname=dirname+"//"
+        os.makedirs("Plots//"+dirname)
+    dirname=dirname+"//"
     return dirname 
         
-def ploter(Datas,Cols,filename,infos,ave):
+def plotinit():
     """
-    Data plotter for OPC,SDS and DHTs.
-    Take OPC Data as Datas, and DHT data though DHTs. It will generate a subplot for each varaible in Cols
-    Plot for Date range in Dates, 
-    in format [Start,End] where the dates have to be in "yyyy-mm-dd" format (i.e "2019-04-30").
-    Read the data out into diffrent html files for each varaible what then can be implemented into a dashboard 
-    Last edit
-    
-    18/05/2019
-    
-    -added make new directory for each plot "Date and filename"
-    
+    Setup for the plot processes, the plots are drawn with the Agg backend (no windows)
     """
-    locname=createdir(filename) #create new directory for output 
-    print(locname)
-    #loop through vraibles
-    for var in Cols:
-        #MAP Plots  
-        if var.upper()=="STATICMAP":
-            print("===================Generating Static Map==============================")
-            titlename="Plots//"+locname+filename+'-'+var #save name 
-            AQMap.GenStaticTimemap(Datas,"pm2.5",ave,titlename,infos)
-        elif var.upper()=="GPSWALK":
-            print("==================Generating GPS Walk map==========================")
-            titlename="Plots//"+locname+filename+'-'+var #save name 
-            AQMap.genmap(Datas,"pm2.5",titlename,infos)
-        
-        #Data Time series plots 
-        else:
-            print("===================Generating time plot=====================")
-            #Create sfig for each varable 
-            fig,ax = plt.subplots(1,1,figsize=(15,8))
+    load("matplotlib.pylab").switch_backend("Agg")
+
+
+def plotvar(Datas,var,filename,locname,infos,ave,Dates,maxpoints=maxpoints,method=method,cache=cache,profile=profiles[profile]):
+    """
+    Plot one varaible for ploter, the plot (or map) is saved as Plots//<locname><filename>-<var>
+    (.html and the image formats of the render profile). Each varaible is plotted on its own
+    so they can be made in parallel, the figure is closed after so memory does not grow.
+    cache is passed on to the maps, which check their own
+    Returns the save name
+    """
+    figname="Plots//"+locname+filename+'-'+var #save name 
+    #MAP Plots  
+    if var.upper()=="STATICMAP":
+        logger.info('Generating Static Map')
+        AQMap=load("AQMapfunctions")
+        AQMap.GenStaticTimemap(Datas,"pm2.5",ave,figname,infos,cache=cache)
+    elif var.upper()=="GPSWALK":
+        logger.info('Generating GPS Walk map')
+        AQMap=load("AQMapfunctions")
+        AQMap.genmap(Datas,"pm2.5",figname,infos,cache=cache)
+    
+    #Data Time series plots 
+    else:
+        logger.info('Generating time plot')
+        plt=load("matplotlib.pylab")
+        mpld3=load("mpld3")
+        downsample=load("AQDownsample").downsample
+        #Create sfig for each varable 
+        fig,ax = plt.subplots(1,1,figsize=(15,8))
+        try:
             alpha=0.8 #faddin for plots
             titledate=""
             lns=[]
@@ -296,7 +322,7 @@ def ploter(Datas,Cols,filename,infos,ave):
             DHT="" #place holder for DHT name  to stop errors in no DHT is in data
               #loop through data dictionary
             for k,df in Datas.items():
-                print("---------Plotting "+k+"--Value "+var+"------------------------")
+                logger.debug('Plotting %s value %s', k, var)
                 info=infos[k]
                 ##sensors=info["Sensors:"]
                 sensors=["SDS011_KP"] 
@@ -307,9 +333,8 @@ def ploter(Datas,Cols,filename,infos,ave):
                     else:
                         sens.append(s) #append sensords 
                         OPC=s
-                        print("OPC = ",OPC)
-                        print("****************************************")
-               
+                        logger.debug('OPC = %s', OPC)
+           
                   #  DHT=""
                 #genrate colores based on sensors 
                 if "OPCN2" in OPC:
@@ -321,155 +346,262 @@ def ploter(Datas,Cols,filename,infos,ave):
                 elif "SDS" in OPC:
                     color=plt.cm.spring(SDS)
                     SDS=SDS+60
-        
+    
                 try:
-                    DF=df[Dates[0]]
                     #plot data in deseried dates need format ["2019-04-29","2019-04-30"] or ["2019-04-30"]
                     try:
-                        if len(Dates)>1:
-                           DF=df[(df.index > Dates[0]) & (df.index <= Dates[1])]
-                           #DF=df[Dates[0]:Dates[1]]
-                           titledate=Dates[0]+"--"+Dates[1]
-                        else:
-                            DF=df[Dates[0]]
-                            titledate=Dates[0]
-                    except:
-                        print("""
-                        -------Time ERROR-------      
-                        Is the Datas in the correct format ?
-                        i.e  ["2019-04-29","2019-04-30"]  for an range 
-                        or  ["2019-04-30"] for a sinlge day ?
-                        """)
-                        print("Dates = ",Dates)
-                    
+                        DF=selectdates(df,Dates)
+                        titledate="--".join(Dates[:2])
+                    except (KeyError,ValueError):
+                        logger.error('Time error, are the Dates %s in the correct format ? '
+                                     'i.e ["2019-04-29","2019-04-30"] for a range or ["2019-04-30"] for a single day', Dates)
+                        continue
+                
                     try: #plot data 
-                        print(var,OPC) 
+                        logger.debug('%s %s', var, OPC) 
+                        ln=None #no line for this file yet
                         if var=="RH" or var=="T": #if val is temp of RH 
                             try:
                                 if "OPC" in OPC:
-                                    ln=ax.plot(DF["OPC-"+var],label="OPC-"+var,color=color)
+                                    ln=ax.plot(downsample(DF["OPC-"+var],maxpoints,method),label="OPC-"+var,color=color)
                                     labels.append(OPC)
                                     lns.append(ln)
                                     try:
-                                        ln=ax.plot(DF["OPC-"+var+"-CAL"],label="OPC-"+var+"-CAL",linestyle="-.",color=color)
+                                        ln=ax.plot(downsample(DF["OPC-"+var+"-CAL"],maxpoints,method),label="OPC-"+var+"-CAL",linestyle="-.",color=color)
                                         labels.append(OPC)
                                         lns.append(ln)
                                     except:
-                                        print("No calibration Data")
+                                        logger.warning('No calibration data for %s', OPC)
                                 if "DHT-RH" in DF.columns:
-                                    ln=ax.plot(DF[DHT+"-"+var],label=var,linestyle="--",color=color,alpha=alpha)
+                                    ln=ax.plot(downsample(DF[DHT+"-"+var],maxpoints,method),label=var,linestyle="--",color=color,alpha=alpha)
                                     labels.append(DHT+"-"+var)
                                     lns.append(ln)
                             except Exception as e: #If error occures
-                                print("-------ERROR in Plotting RH or T values-----------")
-                                print('Error on line {}'.format(sys.exc_info()[-1].tb_lineno))
-                                print(type(e))
-                                print(e.args)
+                                logger.error('Error in plotting RH or T values')
+                                logger.debug('Error details', exc_info=True)
                                 pass
-                          
-                         
+                      
+                     
                         else:#if not RH or T value 
                             if "SDS" in OPC:
-                                print("PLOTTING SDS")
+                                logger.debug('PLOTTING SDS')
                                 try:
                                     if "VS" in var: #Deal with ratios and new names of sds 
                                         Var="sds-"+var[0:var.find("VS")+2]+"sds-"+var[var.find("VS")+2:len(var)]
-                                        ln=ax.plot(DF[Var],label=OPC,color=color,alpha=alpha)
+                                        ln=ax.plot(downsample(DF[Var],maxpoints,method),label=OPC,color=color,alpha=alpha)
                                     else:
                                         #plot normal data
-                                        print(var)
-                                        ln=ax.plot(DF["sds-"+var],label=OPC,color=color,alpha=alpha)
+                                        logger.debug('%s', var)
+                                        ln=ax.plot(downsample(DF["sds-"+var],maxpoints,method),label=OPC,color=color,alpha=alpha)
                                 except Exception as e: #If error occures
-                                    print("-------------ERROR in Plotting SDS data "+ var +"--------------")
-                                    print('Error on line {}'.format(sys.exc_info()[-1].tb_lineno))
-                                    print(type(e))
-                                    print(e.args)
+                                    logger.error('Error in plotting SDS data %s', var)
+                                    logger.debug('Error details', exc_info=True)
                                     pass
                             else:
-                                
+                            
                                 if var in DF.columns:
-                                    ln=ax.plot(DF[var],label=OPC,alpha=alpha,color=color)
+                                    ln=ax.plot(downsample(DF[var],maxpoints,method),label=OPC,alpha=alpha,color=color)
+                    
+            
                         
-                
-                            
-                            lns.append(ln)
-                            labels.append(OPC)        
-                            
-                             
+                            if ln is not None: #the plot failed or the column is missing
+                                lns.append(ln)
+                                labels.append(OPC)        
+                        
+                         
                     except Exception as e:
-                            print("""
-                            --------PLOT ERROR---------
-                    
-                            """)
-                            print('Error on line {}'.format(sys.exc_info()[-1].tb_lineno))
-                            print(type(e))
-                            print(e.args)
+                            logger.error('Plot error for %s: %s', var, e)
+                            logger.debug('Error details', exc_info=True)
                             pass
-                  
+              
                 except Exception as e: #If error occures
-                        print('Error on line {}'.format(sys.exc_info()[-1].tb_lineno))
-                        print(type(e))
-                        print(e.args)
+                        logger.error('Plot error for %s %s: %s', k, var, e)
+                        logger.debug('Error details', exc_info=True)
                         pass
-               # print("Check lables for mpld3 interactive legends", labels)
-                interactive_legend = mpld3.plugins.InteractiveLegendPlugin(lns, labels, alpha_unsel=0.1,alpha_over=1, start_visible=True)
-                mpld3.plugins.connect(fig, interactive_legend)
-                #Add y axis labes depending of value 
-                if ("pm" in var and "VS" not in var):
-                    ax.set_ylabel("Mass concenration (ug/m^3)" , fontsize=20)
-                   # ax.set_xlim([0,50]) 
-                elif "RH" in var:
-                     ax.set_ylabel("Realitivy Humidity (%)", fontsize=20)
-                elif "T" in var:
-                    ax.set_ylabel("Temprature (C)", fontsize=20)
-                elif "Flow" in var:
-                    ax.set_ylabel("Flow rate (ml/min)", fontsize=20)
-             #   print(labels,len(labels))
-              #  print(lns,len(lns))
-                #Add axis title and legend 
-                ax.set_title(filename+"-"+titledate+"\n ( "+var+" )",fontsize=20)
-                ax.legend()
-                ax.grid()
-                fig.subplots_adjust(right=0.7)
-                figname = "Plots//"+locname+filename+'-'+var #save name 
+           # print("Check lables for mpld3 interactive legends", labels)
+            interactive_legend = mpld3.plugins.InteractiveLegendPlugin(lns, labels, alpha_unsel=0.1,alpha_over=1, start_visible=True)
+            mpld3.plugins.connect(fig, interactive_legend)
+            #Add y axis labes depending of value 
+            if ("pm" in var and "VS" not in var):
+                ax.set_ylabel("Mass concenration (ug/m^3)" , fontsize=20)
+               # ax.set_xlim([0,50]) 
+            elif "RH" in var:
+                 ax.set_ylabel("Realitivy Humidity (%)", fontsize=20)
+            elif "T" in var:
+                ax.set_ylabel("Temprature (C)", fontsize=20)
+            elif "Flow" in var:
+                ax.set_ylabel("Flow rate (ml/min)", fontsize=20)
+         #   print(labels,len(labels))
+          #  print(lns,len(lns))
+            #Add axis title and legend 
+            ax.set_title(filename+"-"+titledate+"\n ( "+var+" )",fontsize=20)
+            ax.legend()
+            ax.grid()
+            fig.subplots_adjust(right=0.7)
+            if profile["html"]:
                 mpld3.save_html(fig,figname+".html")
-            
-                #double columns does not work with intractive legends on mpld3 but it will work for normal plots 
-                #if var == "pm2.5" or var=="ParticleCount": #double axis for pm2.5 with RH
-                #    if "DHT-RH" in DF.columns:
-                #        ax2=ax.twinx()
-                #        ax2
-                #        x=DF.index
-                #        y=np.ones(len(x), dtype=int)*80 #create 80% RH line 
-                #        ax2.plot(x,y,linestyle = "--",color="black")
-                #        ln2=ax2.plot(DF["DHT-RH"],color="Teal",alpha=0.5)
-                #        ax2.set_ylabel('RH (%)', color='Teal')
-                #        ax2.tick_params('y', colors='Teal')
-                #        for tl in ax2.get_yticklabels():
-                #            tl.set_color('Teal')
-                #        lns.append(ln2)
-                #        split=OPC.split(":")
-                #        labels.append(split[0]+":DHT22")
-            
-            
-            fig.savefig(figname+".png",dpi=300,format='png')
-      
-            
-#    #KP HERE
+    
+            #double columns does not work with intractive legends on mpld3 but it will work for normal plots 
+            #if var == "pm2.5" or var=="ParticleCount": #double axis for pm2.5 with RH
+            #    if "DHT-RH" in DF.columns:
+            #        ax2=ax.twinx()
+            #        ax2
+            #        x=DF.index
+            #        y=np.ones(len(x), dtype=int)*80 #create 80% RH line 
+            #        ax2.plot(x,y,linestyle = "--",color="black")
+            #        ln2=ax2.plot(DF["DHT-RH"],color="Teal",alpha=0.5)
+            #        ax2.set_ylabel('RH (%)', color='Teal')
+            #        ax2.tick_params('y', colors='Teal')
+            #        for tl in ax2.get_yticklabels():
+            #            tl.set_color('Teal')
+            #        lns.append(ln2)
+            #        split=OPC.split(":")
+            #        labels.append(split[0]+":DHT22")
+    
+    
+            for fmt in profile["formats"]:
+                fig.savefig(figname+"."+fmt,dpi=profile["dpi"],format=fmt)
+        finally:
+            plt.close(fig)
+    return figname
 
+
+def plotjob(*job):
+    """
+    plotvar in a plot process, returns the save name with the stage totals (see AQTiming) and
+    import times of the plot, which stay in the process, so runplots can add them to the run's
+    """
+    AQTiming.stages.clear()
+    importtimes.clear()
+    figname=plotvar(*job)
+    return figname,dict(AQTiming.stages),dict(importtimes)
+
+
+def plotkey(Datas,var,filename,ave,Dates,maxpoints,method,profile):
+    """
+    Fingerprint of what a time plot is made from, the data columns of the varaible,
+    the settings and the plotting code (see AQCache)
+    """
+    AQCache=load("AQCache")
+    data={k:df[[c for c in df.columns if var in c]] for k,df in Datas.items()}
+    return AQCache.fingerprint(data,var,filename,ave,Dates,maxpoints,method,profile,
+                               AQCache.codeversion(__file__,load("AQDownsample")))
+
+
+@AQTiming.timed()
+def ploter(Datas,Cols,filename,infos,ave,maxpoints=maxpoints,method=method,workers=1,Dates=Dates,cache=cache,dashboard=dashboard,profile=profile):
+    """
+    Data plotter for OPC,SDS and DHTs.
+    Take OPC Data as Datas, and DHT data though DHTs. It will generate a subplot for each varaible in Cols
+    Plot for Date range in Dates, 
+    in format [Start,End] where the dates have to be in "yyyy-mm-dd" format (i.e "2019-04-30").
+    Read the data out into diffrent html files for each varaible what then can be implemented into a dashboard 
+    Each line is downsampled to maxpoints points with method (see AQDownsample) before plotting,
+    so the html files stay the same size however long the data is
+    workers: number of processes plotting the varaibles (with plotvar) at once,
+    None for one per core, 1 to plot them in turn
+    cache: skip the plots already made from the same data, settings and code,
+    the maps and dashboard page check their own (see AQCache)
+    dashboard: "plots" for a page of the plots of each varaible (genLivedash), "data" for one page
+    drawing the varaibles from one data file in the browser (genDatadash), only the maps are made as plots
+    profile: render profile name (see profiles), sets the image formats and dpi and if the html plots,
+    maps and dashboard page are made
+    Last edit
+    
+    18/05/2019
+    
+    -added make new directory for each plot "Date and filename"
+    
+    """
+    locname=createdir(filename,Dates) #create new directory for output 
+    logger.debug('%s', locname)
+    profile=profiles[profile]
+    jobs,keys=planplots(Datas,Cols,filename,locname,infos,ave,maxpoints,method,Dates,cache,dashboard,profile)
+    runplots(jobs,keys,workers)
     #generate dashboard 
-    genLivedash(locname,filename,Cols)
+    makedash(locname,filename,Datas,Cols,cache,dashboard,profile,Dates)
+
+
+def planplots(Datas,Cols,filename,locname,infos,ave,maxpoints,method,Dates,cache,dashboard,profile):
+    """
+    Plan the plots of ploter, returns the plotvar arguments of the varaibles that are out of date
+    and the cache keys of the plots, to stamp once they are made (see runplots)
+    profile: the render profile (dictionary)
+    """
+    AQCache=load("AQCache")
+    #find the time plots that are out of date
+    keys={}
+    jobs=[]
+    for var in Cols:
+        if var.upper() in mapcols and not profile["maps"]:
+            continue
+        if dashboard=="data" and profile["dashboard"] and var.upper() not in mapcols:
+            continue #drawn by the dashboard page
+        if cache and var.upper() not in mapcols:
+            figname="Plots//"+locname+filename+'-'+var
+            keys[figname]=plotkey(Datas,var,filename,ave,Dates,maxpoints,method,profile)
+            outputs=[figname+"."+fmt for fmt in profile["formats"]]+([figname+".html"] if profile["html"] else [])
+            if AQCache.isfresh(figname,keys[figname],outputs):
+                logger.info('Plot up to date %s', figname)
+                continue
+        jobs.append((Datas,var,filename,locname,infos,ave,Dates,maxpoints,method,cache,profile))
+    return jobs,keys
+
+
+@AQTiming.timed(rows=0)
+def runplots(jobs,keys,workers=1):
+    """
+    Make the planned plots (plotvar arguments), in parallel if there are workers
+    (None for one per core, 1 to plot them in turn), and stamp them in the cache
+    The stage totals and import times of the plot processes are added to the run's
+    (so their seconds are summed over the processes), the files they write are counted here
+    """
+    AQCache=load("AQCache")
+    if workers==1 or len(jobs)<2:
+        fignames=[plotvar(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers,initializer=plotinit) as pool:
+            results=list(pool.map(plotjob,*zip(*jobs)))
+        fignames=[]
+        for figname,totals,imports in results:
+            fignames.append(figname)
+            AQTiming.merge(totals)
+            for name,seconds in imports.items():
+                importtimes[name]=importtimes.get(name,0)+seconds
+    for job,figname in zip(jobs,fignames):
+        logger.info('Saved %s', figname)
+        AQTiming.written(figname+".html",*[figname+"."+fmt for fmt in job[-1]["formats"]])
+        if figname in keys:
+            AQCache.stamp(figname,keys[figname])
+
+
+def makedash(locname,filename,Datas,Cols,cache,dashboard,profile,Dates=None):
+    """
+    Make the dashboard page of ploter, if the render profile (dictionary) has one.
+    The data dashboard only packs the readings in Dates (see selectdates), as the plots show
+    """
+    if not profile["dashboard"]:
+        pass
+    elif dashboard=="data":
+        if Dates:
+            Datas={k:selectdates(df,Dates) for k,df in Datas.items()}
+        load("Genlivehtml").genDatadash(locname,filename,Datas,Cols,cache)
+    else:
+        load("Genlivehtml").genLivedash(locname,filename,Cols,cache)
+
 
+@AQTiming.timed(rows="result")
 def ReadDataset(Folder,sensors,ave):
+    pd=load("pandas")
 
     Data={}#set array to hold file names
     infos={}
 
     file=glob.glob(Folder+'***.csv')
-    print("file = ",file)
+    logger.debug('file = %s', file)
 
     if(len(file) !=  1):
-      print("Wrong number of files files=",files)
+      logger.warning('Wrong number of files files= %s', files)
       exit
 
     data=pd.read_csv(file[0],engine='python')
@@ -478,7 +610,7 @@ def ReadDataset(Folder,sensors,ave):
 
     #print("lat ",data["lat"])
 
-    print(data)
+    logger.debug('%s', data)
 
     #Data["SDS"]=data
     info={}
@@ -497,87 +629,285 @@ def ReadDataset(Folder,sensors,ave):
 
     return Data, infos
 
-print("***********************************")
-print("DataFolder")
-print(DataFolder)
-print("Sens")
-print(Sens)
-print("ave")
-print(ave)
+@AQTiming.timed(rows="result")
+def ReadDevice(Folder):
+    """
+    Read all the data files of a device (Folder***.csv, i.e. a day each from aqmon)
+    into one data set sorted by time
+    """
+    pd=load("pandas")
+    files=sorted(glob.glob(Folder+'***.csv'))
+    logger.debug('files = %s', files)
+    if not files:
+        return pd.DataFrame(columns=["time"])
+    data=pd.concat([pd.read_csv(file,engine='python') for file in files],ignore_index=True,sort=False)
+    with AQTiming.stage("QC",len(data)):
+        data["time"]=pd.to_datetime(data.time,errors="coerce")
+        data=data.dropna(subset=["time"]).sort_values("time",kind="stable").reset_index(drop=True)
+    return data
+
+
+def devicename(Folder):
+    """
+    Name of a device from its data folder
+    """
+    name=os.path.basename(os.path.normpath(Folder)) if Folder else ""
+    return name if name not in ("",".") else "data"
 
-data,infos=ReadDataset(DataFolder,Sens,ave)
 
-print("Data HERE")
-print(data)
+def parsedays(days):
+    """
+    List of the days (yyyy-mm-dd) in days, where each entry is a day or a start:end range
+    """
+    out=[]
+    for day in days or []:
+        start,_,end=day.partition(":")
+        start=datetime.strptime(start,"%Y-%m-%d")
+        end=datetime.strptime(end,"%Y-%m-%d") if end else start
+        while start<=end:
+            out.append(start.strftime("%Y-%m-%d"))
+            start=start+timedelta(days=1)
+    return out
+
+
+def batch(devices,days,Cols,filename,ave,maxpoints=maxpoints,method=method,workers=workers,cache=cache,
+          dashboard=dashboard,profile=profile,max_number_sensors=max_number_sensors):
+    """
+    Make a dashboard for each day of each device in one run.
+    Each device's data files are read once and split into days, then all the plots of every
+    dashboard are planned and made together (in one process pool), so a month for a number
+    of devices is one run. The cache skips the days already made (see AQCache).
+    devices: data folders (prefixes) of the devices, days: days or start:end ranges (see parsedays),
+    every day in the data if empty.
+    An index page Plots//<filename>-index.html links all the dashboards.
+    Returns the dashboard page names by device and day
+    """
+    profile=profiles[profile]
+    days=parsedays(days)
+    plans=[]
+    for Folder in devices:
+        name=devicename(Folder)
+        data=ReadDevice(Folder)
+        byday={day:df.reset_index(drop=True) for day,df in data.groupby(data["time"].dt.strftime("%Y-%m-%d"))}
+        info={"Site":[name],"Sensor":["Sensor"],"Location":["GPS"],"start date":["start date"],
+              "end date":["end date"],"Link":["Link"]}
+        for day in days or sorted(byday):
+            if day not in byday:
+                continue
+            Data,Datainfos=splitsensors(byday[day],info,max_number_sensors)
+            if not Data:
+                continue
+            dayname=filename+"-"+name+"-"+day
+            locname=createdir(filename+"-"+name,[day])
+            jobs,keys=planplots(Data,Cols,dayname,locname,Datainfos,ave,maxpoints,method,[day],cache,dashboard,profile)
+            plans.append((name,day,locname,dayname,Data,jobs,keys))
+    #make every plot together
+    jobs=[job for plan in plans for job in plan[5]]
+    keys={k:v for plan in plans for k,v in plan[6].items()}
+    runplots(jobs,keys,workers)
+    pages={}
+    for name,day,locname,dayname,Data,_,_ in plans:
+        makedash(locname,dayname,Data,Cols,cache,dashboard,profile,[day])
+        pages.setdefault(name,{})[day]=locname+dayname+".html"
+    if profile["dashboard"]:
+        load("Genlivehtml").genIndex(filename,pages)
+    return pages
+
+
+@AQTiming.timed()
+def splitsensors(data,infos,max_number_sensors=max_number_sensors):
+    """
+    Split the data file into a data set for each SDS sensor (sds01 to sds0N columns)
+    that has readings, with the GPS columns. Returns the data and info dictionaries
+    """
+    pd=load("pandas")
+    np=load("numpy")
+    Data={}
+    Datainfos={}
 
+    if max_number_sensors > 9:
+       logger.error('Error, too many sensors')
 
-print("***********************************")
 
-max_number_sensors = 4
+    for isens in range(1,max_number_sensors+1):
 
-if max_number_sensors > 9:
-   print("Error, too many sensors")
 
+      logger.debug('sensor number = %s', isens)
 
-for isens in range(1,max_number_sensors+1):
+      sensor_name_pm2p5=str("sds0"+str(isens)+"-pm2.5")
+      sensor_name_pm10=str("sds0"+str(isens)+"-pm10")
+      sensor_name_TSP=str("sds0"+str(isens)+"-TSP")
 
+      wanted_keys = ['time','lat', 'lon','alt',sensor_name_pm2p5,sensor_name_pm10,sensor_name_TSP] # The keys you want
 
-  print("sensor number = ",isens)
+      data_subset=pd.DataFrame()
+      data_subset2=pd.DataFrame()
 
-  sensor_name_pm2p5=str("sds0"+str(isens)+"-pm2.5")
-  sensor_name_pm10=str("sds0"+str(isens)+"-pm10")
-  sensor_name_TSP=str("sds0"+str(isens)+"-TSP")
+      for wanted in wanted_keys:
 
-  wanted_keys = ['time','lat', 'lon','alt',sensor_name_pm2p5,sensor_name_pm10,sensor_name_TSP] # The keys you want
+        logger.debug('wanted = %s', wanted)
 
-  data_subset=pd.DataFrame()
-  data_subset2=pd.DataFrame()
+        if "pm2.5" in str(wanted):
+          data_subset["sds-pm2.5"]=data[wanted]
+        elif "pm10" in str(wanted):
+          data_subset["sds-pm10"]=data[wanted]
+        elif "TSP" in str(wanted):
+          data_subset["sds-TSP"]=data[wanted]
+        else:
+          data_subset[wanted]=data[wanted]
+    
+      logger.debug('data_subset\n%s', data_subset)
 
-  for wanted in wanted_keys:
+      # Mask out all values where lat / lon are nan
 
-    print("wanted = ",wanted)
+      data_subset.reset_index(inplace=True)
 
-    if "pm2.5" in str(wanted):
-      data_subset["sds-pm2.5"]=data[wanted]
-    elif "pm10" in str(wanted):
-      data_subset["sds-pm10"]=data[wanted]
-    elif "TSP" in str(wanted):
-      data_subset["sds-TSP"]=data[wanted]
-    else:
-      data_subset[wanted]=data[wanted]
-    
-  print("data_subset")
-  print(data_subset)
+      data_subset2['lon'] = data_subset['lon'][~np.isnan(data_subset['lon'])]
+      data_subset2['lat'] = data_subset['lat'][~np.isnan(data_subset['lon'])]
+      data_subset2['alt'] = data_subset['alt'][~np.isnan(data_subset['lon'])]
+      data_subset2['sds-pm2.5'] = data_subset['sds-pm2.5'][~np.isnan(data_subset['lon'])]
+      data_subset2['sds-pm10'] = data_subset['sds-pm10'][~np.isnan(data_subset['lon'])]
+      data_subset2['sds-TSP'] = data_subset['sds-TSP'][~np.isnan(data_subset['lon'])]
+      data_subset2['time'] = data_subset['time'][~np.isnan(data_subset['lon'])]
 
-  # Mask out all values where lat / lon are nan
+      logger.debug('Subset time\n%s', data_subset2['time'])
 
-  data_subset.reset_index(inplace=True)
+      ##data_subset2.set_index('time', inplace=True)  
 
-  data_subset2['lon'] = data_subset['lon'][~np.isnan(data_subset['lon'])]
-  data_subset2['lat'] = data_subset['lat'][~np.isnan(data_subset['lon'])]
-  data_subset2['alt'] = data_subset['alt'][~np.isnan(data_subset['lon'])]
-  data_subset2['sds-pm2.5'] = data_subset['sds-pm2.5'][~np.isnan(data_subset['lon'])]
-  data_subset2['sds-pm10'] = data_subset['sds-pm10'][~np.isnan(data_subset['lon'])]
-  data_subset2['sds-TSP'] = data_subset['sds-TSP'][~np.isnan(data_subset['lon'])]
-  data_subset2['time'] = data_subset['time'][~np.isnan(data_subset['lon'])]
+      logger.debug('Number of non nan values = %s', np.count_nonzero(~np.isnan(data_subset["sds-pm2.5"])))
 
-  print("Subset time")
-  print(data_subset2['time'])
+      if(np.count_nonzero(~np.isnan(data_subset2["sds-pm2.5"])) > 0):
+        logger.debug('SDS pm2.5 has some non-nan values for sensor %s call plotting routines', isens)
 
-  ##data_subset2.set_index('time', inplace=True)  
+        Data["SDS0"+str(isens)]=data_subset2
+        Datainfos["SDS0"+str(isens)]=infos
 
-  print("Number of non nan values = ",np.count_nonzero(~np.isnan(data_subset["sds-pm2.5"])))
+    return Data,Datainfos
 
-  if(np.count_nonzero(~np.isnan(data_subset2["sds-pm2.5"])) > 0):
-    print("SDS pm2.5 has some non-nan values for sensor ",isens," call plotting routines")
 
-    Data={}
-    infos={}
+def summary(Folder):
+    """
+    Print a summary of the data files in Folder, the number of rows, the time span and
+    the count, mean, min and max of each column. Only uses the csv module so it is quick.
+    """
+    for file in sorted(glob.glob(Folder+'***.csv')):
+        with codecs.open(file,"r",encoding="utf8",errors="ignore") as f:
+            reader=csv.reader(f)
+            header=next(reader,[])
+            rows=0
+            start=end=""
+            stats=[[0,0.0,float("inf"),float("-inf")] for col in header[1:]]
+            for row in reader:
+                if len(row)!=len(header):
+                    continue
+                rows=rows+1
+                start=min(start,row[0]) if start else row[0] #times are yyyy-mm-dd hh:mm:ss so sort as text
+                end=max(end,row[0])
+                for stat,value in zip(stats,row[1:]):
+                    try:
+                        value=float(value)
+                    except ValueError:
+                        continue
+                    if value!=value: #nan
+                        continue
+                    stat[0]=stat[0]+1
+                    stat[1]=stat[1]+value
+                    stat[2]=min(stat[2],value)
+                    stat[3]=max(stat[3],value)
+        print(file)
+        print("  rows: "+str(rows)+"  from: "+start+"  to: "+end)
+        print("  {:<14}{:>8}{:>12}{:>12}{:>12}".format("column","count","mean","min","max"))
+        for col,(n,total,lo,hi) in zip(header[1:],stats):
+            if n:
+                print("  {:<14}{:>8}{:>12.3f}{:>12.3f}{:>12.3f}".format(col,n,total/n,lo,hi))
+            else:
+                print("  {:<14}{:>8}{:>12}{:>12}{:>12}".format(col,0,"-","-","-"))
+
+
+def parseargs(argv=None):
+    """
+    Read the settings from the command line, the defaults are the settings at the top of
+    this file, or those in the --config JSON file (keys named as the options, i.e. "dates")
+    """
+    parser=argparse.ArgumentParser(description="Plot the AQ data files into a dashboard of plots and maps")
+    parser.add_argument("--config",help="JSON file of settings, the options given here override it")
+    parser.add_argument("--folder",default=DataFolder,help="folder (prefix) of the data .csv files")
+    parser.add_argument("--dates",nargs="+",default=Dates,help="day, or start and end day, to plot")
+    parser.add_argument("--vals",nargs="+",default=vals,help="varaibles to plot, STATICMAP / GPSWALK for maps")
+    parser.add_argument("--ave",default=ave,help="averaging period, i.e. 1T, or RAW")
+    parser.add_argument("--filename",default=filename,help="name of the dashboard and plots")
+    parser.add_argument("--sensors",type=int,default=max_number_sensors,help="number of SDS sensors in the data file")
+    parser.add_argument("--profile",default=profile,choices=sorted(profiles),help="render profile")
+    parser.add_argument("--dashboard",default=dashboard,choices=["plots","data"],help="dashboard page type")
+    parser.add_argument("--workers",type=int,default=workers,help="plot processes (default one per core)")
+    parser.add_argument("--maxpoints",type=int,default=maxpoints,help="points per plotted line")
+    parser.add_argument("--method",default=method,choices=["minmax","lttb"],help="downsampling method")
+    parser.add_argument("--no-cache",dest="cache",action="store_false",default=cache,help="remake every output")
+    parser.add_argument("--devices",nargs="+",help="batch mode, data folders of the devices to make a dashboard "
+                        "for each day of (see --days)")
+    parser.add_argument("--days",nargs="+",help="batch mode days, yyyy-mm-dd or start:end ranges (default all)")
+    parser.add_argument("--summary",action="store_true",help="only print a summary of the data files")
+    parser.add_argument("-v","--verbose",action="count",default=0,help="more messages, -v progress, -vv debugging")
+    parser.add_argument("-q","--quiet",action="store_true",help="only print errors")
+    parser.add_argument("--importtime",action="store_true",help="print the time taken to import each library")
+    parser.add_argument("--report",help="write a JSON run report of the time, rows and bytes written of each stage")
+    parser.add_argument("--profile-stage",help="profile a stage in the run report (i.e. GetDataset, GenStaticTimemap, "
+                        "ploter), the plots are then made in this process")
+    parser.add_argument("--profiler",default="cprofile",choices=["cprofile","tracemalloc"],
+                        help="profile time per function (cprofile) or memory per line (tracemalloc)")
+    args,rest=parser.parse_known_args(argv)
+    if args.config:
+        with open(args.config) as f:
+            config=json.load(f)
+        unknown=set(config)-set(vars(args))
+        if unknown:
+            parser.error("unknown settings in "+args.config+": "+", ".join(sorted(unknown)))
+        parser.set_defaults(**config)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Read the data file and plot all the sensors in it (sds01 to sds04) together,
+    or with --devices make the dashboards of each device and day (see batch)
+    """
+    args=parseargs(argv)
+    if args.quiet:
+        level=logging.ERROR
+    else:
+        level=[logging.WARNING,logging.INFO,logging.DEBUG][min(args.verbose,2)]
+    logging.basicConfig(level=level,format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    AQTiming.reset()
+    if args.profile_stage:
+        AQTiming.setprofile(args.profile_stage,args.profiler)
+        args.workers=1 #stages in the plot processes can not be profiled
+    if args.summary:
+        for Folder in args.devices or [args.folder]:
+            summary(Folder)
+    elif args.devices:
+        batch(args.devices,args.days,args.vals,args.filename,args.ave,maxpoints=args.maxpoints,method=args.method,
+              workers=args.workers,cache=args.cache,dashboard=args.dashboard,profile=args.profile,
+              max_number_sensors=args.sensors)
+    else:
+        logger.info('Data folder %s, averaging %s', args.folder, args.ave)
 
-    Data["SDS"]=data_subset2
-    infos["SDS"]=infos
+        data,infos=ReadDataset(args.folder,Sens,args.ave)
 
-    ploter(Data,vals,filename,infos,ave)
+        logger.debug('Data\n%s', data)
 
+        Data,Datainfos=splitsensors(data,infos,args.sensors)
+        ploter(Data,args.vals,args.filename,Datainfos,args.ave,maxpoints=args.maxpoints,method=args.method,
+               workers=args.workers,Dates=args.dates,cache=args.cache,dashboard=args.dashboard,profile=args.profile)
+    if args.importtime:
+        for name,seconds in sorted(importtimes.items(),key=lambda item: -item[1]):
+            print("{:<20}{:8.3f} s".format(name,seconds))
+    for name,total in AQTiming.stages.items():
+        logger.info('%s: %s calls, %.3f s, %s rows, %s bytes written', name, total["calls"],
+                    total["seconds"], total["rows"], total["bytes"])
+    if args.report:
+        AQTiming.report(args.report,imports=importtimes)
+        logger.info('Run report %s', args.report)
 
 
+if __name__=="__main__":
+    main()